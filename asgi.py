@@ -0,0 +1,229 @@
+"""
+Async serving mode, run it with an ASGI server:
+    uvicorn asgi:application --workers 4
+
+The read only card catalog endpoints (the ones every page load hammers) are
+served here with async database access, so a worker can have many of them
+waiting on postgres at once. Every other route is handed to the Flask app in
+main.py, which runs it on a thread the same way it would under a WSGI server
+"""
+from asgiref.wsgi import WsgiToAsgi
+from psycopg_pool import AsyncConnectionPool
+import psycopg
+import json, io, time
+import config
+import main
+from main import app, InvalidCursorException
+from metrics import AsyncMetricsCursor, track_queries, record_request
+
+pool = AsyncConnectionPool(kwargs = main.DB_CONNECTION_KWARGS | {'cursor_factory': AsyncMetricsCursor},
+                           min_size = getattr(config, 'DB_POOL_MIN_SIZE', 1),
+                           max_size = getattr(config, 'DB_POOL_MAX_SIZE', 10),
+                           timeout = getattr(config, 'DB_POOL_TIMEOUT', 30.0),
+                           check = AsyncConnectionPool.check_connection,
+                           # Opened at startup, it needs the server's event loop
+                           open = False)
+
+async def get_catalog_version(cur: psycopg.AsyncCursor) -> tuple:
+    """Async version of main.get_catalog_version, they share the version and caches"""
+    if main.catalog_version_is_current():
+        return main.catalog_version
+
+    await cur.execute(main.CATALOG_VERSION_QUERY)
+    # This blocks the event loop, but only for as long as it takes to swap the version
+    # in memory. main never holds the lock while waiting on the pool or the database
+    return main.set_catalog_version(await cur.fetchone())
+
+async def get_card_dicts(scryfall_ids: list[str], cur: psycopg.AsyncCursor) -> tuple[list[dict], list[str]]:
+    """Async version of main.get_card_dicts"""
+    await get_catalog_version(cur)
+
+    lookup = main.CardDictsLookup(scryfall_ids)
+    rows = []
+    if lookup.needs_query:
+        await cur.execute(main.CARD_QUERY, lookup.query_params)
+        rows = await cur.fetchall()
+
+    return lookup.finish(rows)
+
+async def api_by_id(request, cur):
+    scryfall_id = request.args.get('scryfall_id')
+
+    if scryfall_id == None:
+        error = {'successful': False, 'error': 'Expected query param "scryfall_id"'}
+        return json.dumps(error)
+
+    catalog = await get_catalog_version(cur)
+    not_modified = main.catalog_not_modified(request.environ, catalog)
+    if not_modified != None:
+        return not_modified
+
+    cards, not_found = await get_card_dicts([scryfall_id], cur)
+    if len(not_found) != 0:
+        return json.dumps({'successful': False, 'error': f"Couldn't find card with ID \"{scryfall_id}\""})
+
+    return main.catalog_response(json.dumps(cards[0]), catalog)
+
+async def api_all_cards_languages(request, cur):
+    scryfall_id = request.args.get('scryfall_id')
+
+    if not scryfall_id:
+        error = {'successful': False, 'error': 'Expected query param "scryfall_id"'}
+        return json.dumps(error)
+
+    catalog = await get_catalog_version(cur)
+    not_modified = main.catalog_not_modified(request.environ, catalog)
+    if not_modified != None:
+        return not_modified
+
+    await cur.execute(main.LANGUAGES_QUERY, (scryfall_id,))
+    rows = await cur.fetchall()
+    if len(rows) == 0:
+        error = {'successful': False, 'error': f"Couldn't find a card with scryfall_id \"{scryfall_id}\""}
+        return json.dumps(error)
+
+    return main.catalog_response(json.dumps(main.language_dicts(rows)), catalog)
+
+async def api_all_cards_many(request, cur):
+    content_type = request.headers.get('Content-Type')
+    if (content_type != 'application/json'):
+        error = {'successful': False, 'error': f"Expected Content-Type: application/json, found {content_type}"}
+        return json.dumps(error)
+
+    request_json = request.get_json(silent=True)
+    if request_json == None:
+        error = {'successful': False, 'error': "Expected json body, but didn't find one"}
+        return json.dumps(error)
+
+    scryfall_ids = request_json.get('scryfall_ids')
+
+    if scryfall_ids == None:
+        error = {'successful': False, 'error': "Couldn't find expected key \"scryfall_ids\""}
+        return json.dumps(error)
+
+    if type(scryfall_ids) != list:
+        error = {'successful': False, 'error': f"Expected key \"scryfall_ids\" to be of type list, got {str(type(scryfall_ids).__name__)}"}
+        return json.dumps(error)
+
+    cards, not_found = await get_card_dicts(scryfall_ids, cur)
+
+    return_obj = {
+        'data': cards,
+        'not_found': not_found
+    }
+
+    return json.dumps(return_obj)
+
+async def api_all_cards(request, cur):
+    params, error = main.parse_all_cards_args(request.args)
+    if error != None:
+        return json.dumps(error)
+
+    search_text, page, default, after = params
+    try:
+        count_query, page_query = main.all_cards_search_queries(search_text, page, default, after)
+    except InvalidCursorException as e:
+        return json.dumps({'successful': False, 'error': str(e)})
+
+    length = None
+    if count_query != None:
+        await cur.execute(*count_query)
+        length = (await cur.fetchone())[0]
+
+    await cur.execute(*page_query)
+    return main.all_cards_search_body(await cur.fetchall(), after, length)
+
+# Maps (method, path) -> handler, anything that isn't here goes to Flask
+ROUTES = {
+    ('GET', '/api/by_id'): api_by_id,
+    ('GET', '/api/all_cards'): api_all_cards,
+    ('POST', '/api/all_cards/many'): api_all_cards_many,
+    ('GET', '/api/all_cards/languages'): api_all_cards_languages
+}
+
+def make_environ(scope: dict, body: bytes) -> dict:
+    """Enough of a WSGI environ for the werkzeug Request (and helpers) our handlers use"""
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body)
+    }
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+            name = f'HTTP_{name}'
+        value = value.decode('latin-1')
+        # Repeated headers are joined into one like WSGI servers do
+        if name in environ:
+            value = f'{environ[name]},{value}'
+        environ[name] = value
+
+    return environ
+
+async def handle(handler, scope: dict, receive, send):
+    started_at = time.perf_counter()
+    query_stats = track_queries()
+
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body', False):
+            break
+
+    request = app.request_class(make_environ(scope, body))
+
+    try:
+        async with pool.connection() as con:
+            response = await handler(request, con.cursor())
+    except Exception:
+        app.logger.exception(f"Exception on {scope['path']} [{scope['method']}]")
+        response = app.response_class('Internal Server Error', status=500)
+
+    # Handlers return strings like Flask views do
+    if type(response) == str:
+        response = app.response_class(response)
+    main.compress_response(response, request.accept_encodings)
+
+    # Same as main.record_request_metrics, the endpoint is named after the Flask view
+    record_request(handler.__name__, scope['method'], response.status_code,
+                   time.perf_counter() - started_at, len(body), response.content_length, query_stats)
+
+    await send({
+        'type': 'http.response.start',
+        'status': response.status_code,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in response.headers.items()]
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await pool.open()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+flask_application = WsgiToAsgi(app)
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    if scope['type'] == 'http':
+        handler = ROUTES.get((scope['method'], scope['path']))
+        if handler != None:
+            return await handle(handler, scope, receive, send)
+
+    return await flask_application(scope, receive, send)
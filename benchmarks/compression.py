@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+"""
+CPU cost versus bytes saved for each level of every encoding
+compression.py supports, on a captured API response. For example:
+    curl -s -X POST -H 'Content-Type: application/json' \\
+         -d '{"scryfall_ids": [...]}' http://localhost:5000/api/all_cards/many > many.json
+    python benchmarks/compression.py many.json [iterations]
+Doesn't need a database or config.py
+"""
+import os, sys, timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from compression import available_encodings, compress
+
+# The levels each encoding accepts (gzip's level, brotli's quality)
+LEVELS = {
+    'gzip': range(1, 10),
+    'br': range(0, 12)
+}
+
+if len(sys.argv) < 2:
+    print(__doc__)
+    sys.exit(1)
+
+with open(sys.argv[1], 'rb') as f:
+    payload = f.read()
+iterations = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+print(f"Payload is {len(payload)} bytes")
+print(f"{'encoding':<9} {'level':>5} {'ms':>8} {'MB/s':>8} {'bytes':>9} {'saved':>7}")
+for encoding in available_encodings():
+    for level in LEVELS[encoding]:
+        start = timeit.default_timer()
+        for _ in range(iterations):
+            compressed = compress(payload, encoding, level)
+        seconds = (timeit.default_timer() - start) / iterations
+
+        saved = 1 - len(compressed) / len(payload)
+        print(f"{encoding:<9} {level:>5} {seconds * 1000:>8.2f} {len(payload) / seconds / 1000000:>8.1f} {len(compressed):>9} {saved:>7.1%}")
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Sends a mix of catalog API requests (searches, pages, by_id, languages and
+many) to a running server from many threads at once and reports throughput
+and latency. Run it against each serving mode on the same machine, ex.
+    gunicorn main:app --workers 4 --threads 8 --bind :8000
+    uvicorn asgi:application --workers 4 --port 8000
+    python benchmarks/load_test.py http://localhost:8000 --concurrency 64 --duration 30
+Only needs the standard library
+"""
+from urllib.parse import urlsplit, quote
+import argparse, http.client, json, random, statistics, threading, time
+
+SEARCHES = ['el', 'bolt', 'dragon', 'lightning', 'sliver']
+
+def make_connection(url) -> http.client.HTTPConnection:
+    if url.scheme == 'https':
+        return http.client.HTTPSConnection(url.netloc, timeout=30)
+    return http.client.HTTPConnection(url.netloc, timeout=30)
+
+def fetch_json(url, path: str):
+    connection = make_connection(url)
+    connection.request('GET', path)
+    body = connection.getresponse().read()
+    connection.close()
+    return json.loads(body)
+
+def make_requests(scryfall_ids: list[str]) -> list[tuple[str, str, bytes | None]]:
+    """The (method, path, body) requests the workers pick from"""
+    requests = []
+    for search in SEARCHES:
+        requests.append(('GET', f'/api/all_cards?query=search&text={quote(search)}&default=true', None))
+    for page in range(5):
+        requests.append(('GET', f'/api/all_cards?page={page}&default=true', None))
+    for scryfall_id in scryfall_ids:
+        requests.append(('GET', f'/api/by_id?scryfall_id={scryfall_id}', None))
+        requests.append(('GET', f'/api/all_cards/languages?scryfall_id={scryfall_id}', None))
+    for _ in range(5):
+        body = json.dumps({'scryfall_ids': random.sample(scryfall_ids, min(len(scryfall_ids), 20))}).encode()
+        requests.append(('POST', '/api/all_cards/many', body))
+    return requests
+
+def worker(url, requests: list, deadline: float, latencies: list, errors: list):
+    connection = make_connection(url)
+    while time.monotonic() < deadline:
+        method, path, body = random.choice(requests)
+        headers = {'Accept-Encoding': 'gzip'}
+        if body != None:
+            headers['Content-Type'] = 'application/json'
+
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            connection.close()
+            connection = make_connection(url)
+            continue
+        latencies.append(time.perf_counter() - start)
+
+        if response.status != 200:
+            errors.append(f'{response.status} from {method} {path}')
+        # Servers that don't do keep-alive close after every response
+        if response.will_close:
+            connection.close()
+            connection = make_connection(url)
+    connection.close()
+
+parser = argparse.ArgumentParser(description='Load test the catalog API')
+parser.add_argument('base_url', help='ex. http://localhost:8000')
+parser.add_argument('--concurrency', type=int, default=32, help='requests in flight at once')
+parser.add_argument('--duration', type=float, default=20, help='seconds to run for')
+args = parser.parse_args()
+
+url = urlsplit(args.base_url)
+cards = fetch_json(url, '/api/all_cards?page=0&default=true')['cards']
+scryfall_ids = [card['scryfall_id'] for card in cards]
+if len(scryfall_ids) == 0:
+    parser.error("The server has no cards, import the catalog first")
+requests = make_requests(scryfall_ids)
+
+# list.append is atomic, so the workers can share these
+latencies = []
+errors = []
+deadline = time.monotonic() + args.duration
+threads = [threading.Thread(target=worker, args=(url, requests, deadline, latencies, errors)) for _ in range(args.concurrency)]
+start = time.monotonic()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+elapsed = time.monotonic() - start
+
+print(f"{len(latencies)} requests in {elapsed:.1f}s with {args.concurrency} in flight, {len(errors)} errors")
+if len(errors) != 0:
+    print(f"First error: {errors[0]}")
+if len(latencies) != 0:
+    latencies.sort()
+    print(f"Throughput: {len(latencies) / elapsed:.1f} requests/s")
+    print(f"Latency ms: mean {statistics.mean(latencies) * 1000:.1f}, "
+          f"p50 {latencies[len(latencies) // 2] * 1000:.1f}, "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f}")
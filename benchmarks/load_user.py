@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+"""
+Times load_user (which Flask-Login runs on every request of a logged in user)
+when the user comes from the session and when it has to be read from the
+database, including checking a connection out of the pool for it.
+Needs config.py, run it from the repo root:
+    python benchmarks/load_user.py [iterations]
+"""
+import os, sys, time, timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from flask import session
+
+def time_load_user(user_id: int, from_session: bool, iterations: int) -> float:
+    """Average time in microseconds for one request's load_user"""
+    total = 0
+    for _ in range(iterations):
+        with main.app.test_request_context('/'):
+            if from_session:
+                session['user'] = [user_id, 'benchmark', time.time()]
+
+            start = timeit.default_timer()
+            main.load_user(user_id)
+            # The connection is only given back when the request ends
+            main.return_database_connection(None)
+            total += timeit.default_timer() - start
+    return total / iterations * 1000000
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+with main.pool.connection() as con:
+    user_id = con.execute('''SELECT ID FROM Users ORDER BY ID LIMIT 1''').fetchone()[0]
+
+from_database = time_load_user(user_id, False, iterations)
+from_session = time_load_user(user_id, True, iterations)
+
+print(f"From the database: {from_database:.1f} us per request")
+print(f"From the session:  {from_session:.1f} us per request")
+print(f"Saved:             {from_database - from_session:.1f} us per request")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Login throughput at different Argon2 costs. Many threads check a password
+through PasswordHashingPool at once, like a burst of logins would, and the
+logins per second, latency and number turned away are reported for each cost.
+Doesn't need a database or config.py, run it from the repo root:
+    python benchmarks/password_hashing.py [--workers 2] [--max-queued 8] [--concurrency 32]
+"""
+import os, sys, argparse, threading, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from argon2 import PasswordHasher
+from password_hashing import PasswordHashingPool, HashingPoolFullException
+
+# (time_cost, memory_cost in KiB), the third is argon2-cffi's default
+COSTS = [(1, 19456), (2, 19456), (3, 65536), (4, 131072)]
+
+def login_burst(hashing_pool: PasswordHashingPool, password_hash: str, concurrency: int, logins_per_thread: int) -> tuple[list[float], int, float]:
+    """Returns the latency of every accepted login, how many were turned away and how long it all took"""
+    latencies = []
+    rejected = []
+
+    def log_in():
+        for _ in range(logins_per_thread):
+            start = time.perf_counter()
+            try:
+                hashing_pool.verify(password_hash, 'correct horse battery staple')
+            except HashingPoolFullException:
+                rejected.append(1)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=log_in) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(rejected), time.perf_counter() - start
+
+parser = argparse.ArgumentParser(description='Benchmark login throughput at different Argon2 costs')
+parser.add_argument('--workers', type=int, default=2, help='PASSWORD_HASH_WORKERS')
+parser.add_argument('--max-queued', type=int, default=8, help='PASSWORD_HASH_MAX_QUEUED')
+parser.add_argument('--parallelism', type=int, default=4, help='ARGON2_PARALLELISM')
+parser.add_argument('--concurrency', type=int, default=32, help='logins attempted at once')
+parser.add_argument('--logins', type=int, default=5, help='logins each thread attempts')
+args = parser.parse_args()
+
+print(f"{args.workers} workers, {args.max_queued} queued, {args.concurrency} logins at once")
+print(f"{'time':>4} {'memory KiB':>10} {'logins/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'turned away':>12}")
+for time_cost, memory_cost in COSTS:
+    hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=args.parallelism)
+    password_hash = hasher.hash('correct horse battery staple')
+    hashing_pool = PasswordHashingPool(hasher, args.workers, args.max_queued)
+
+    latencies, rejected, elapsed = login_burst(hashing_pool, password_hash, args.concurrency, args.logins)
+    latencies.sort()
+    if len(latencies) == 0:
+        print(f"{time_cost:>4} {memory_cost:>10} {'-':>9} {'-':>8} {'-':>8} {rejected:>12}")
+        continue
+
+    print(f"{time_cost:>4} {memory_cost:>10} {len(latencies) / elapsed:>9.1f} "
+          f"{latencies[len(latencies) // 2] * 1000:>8.1f} {latencies[int(len(latencies) * 0.95)] * 1000:>8.1f} {rejected:>12}")
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+"""
+Times the card name search behind /api/all_cards?query=search for short and
+long search strings, with the trigram indexes and with postgres told not to
+use any index (what every search cost before the indexes existed).
+Needs config.py and an imported catalog, run it from the repo root:
+    python benchmarks/search.py [repeats]
+"""
+import os, sys, statistics, timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+
+SEARCHES = ['el', 'elf', 'bolt', 'lightning', 'jace, the mind sculptor', 'emrakul, the aeons torn', 'zzzzzz']
+
+def time_search(cur, search_text: str, default: bool, repeats: int) -> float:
+    """Median time in ms for the count and first page of a search"""
+    count_query, page_query = main.all_cards_search_queries(search_text, 0, default, None)
+    times = []
+    for _ in range(repeats):
+        start = timeit.default_timer()
+        cur.execute(*count_query).fetchone()
+        cur.execute(*page_query).fetchall()
+        times.append((timeit.default_timer() - start) * 1000)
+    return statistics.median(times)
+
+repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+
+with main.pool.connection() as con:
+    cur = con.cursor()
+    print(f"{'search':<26} {'default':<8} {'indexed ms':>11} {'no index ms':>12}")
+    for search_text in SEARCHES:
+        for default in [False, True]:
+            indexed = time_search(cur, search_text, default, repeats)
+
+            cur.execute('SET enable_indexscan = off')
+            cur.execute('SET enable_bitmapscan = off')
+            unindexed = time_search(cur, search_text, default, repeats)
+            cur.execute('RESET enable_indexscan')
+            cur.execute('RESET enable_bitmapscan')
+
+            print(f"{search_text:<26} {str(default):<8} {indexed:>11.2f} {unindexed:>12.2f}")
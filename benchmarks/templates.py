@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+"""
+Times rendering each page the way it used to be done (reading the file and
+calling render_template_string on every request) against render_template,
+which compiles each template once and caches it.
+Needs config.py, run it from the repo root:
+    python benchmarks/templates.py [iterations]
+"""
+import os, sys, timeit
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import main
+from flask import render_template, render_template_string
+
+# Template name -> the variables its route passes in
+PAGES = {
+    'signup.html': {},
+    'login.html': {},
+    'collection.html': {'username': 'me'},
+    'collection_add.html': {'username': 'me'},
+    'generate_token.html': {},
+    'deckbuilder.html': {}
+}
+
+def render_from_file(template_name: str, context: dict) -> str:
+    with open(os.path.join(main.app.root_path, 'templates', template_name), 'r') as f:
+        return render_template_string(f.read(), **context)
+
+def time_render(render, template_name: str, context: dict, iterations: int) -> float:
+    """Average time in microseconds for one render"""
+    start = timeit.default_timer()
+    for _ in range(iterations):
+        render(template_name, context)
+    return (timeit.default_timer() - start) / iterations * 1000000
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+with main.app.test_request_context('/'):
+    print(f"{'template':<22} {'from file us':>13} {'cached us':>10}")
+    for template_name, context in PAGES.items():
+        from_file = time_render(render_from_file, template_name, context, iterations)
+        cached = time_render(lambda name, context: render_template(name, **context), template_name, context, iterations)
+        print(f"{template_name:<22} {from_file:>13.1f} {cached:>10.1f}")
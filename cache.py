@@ -0,0 +1,85 @@
+from collections import OrderedDict
+import threading, time
+
+class LRUCache:
+    """
+    A bounded, thread safe, least recently used cache.
+    Counts hits, misses and evictions so we can tell if it's the right size
+    """
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        # A size of 0 turns the cache off
+        if self.max_size <= 0:
+            return
+
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._items),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+class TTLCache(LRUCache):
+    """
+    An LRUCache where entries also expire ttl seconds after they're put
+    """
+    def __init__(self, max_size: int, ttl: float):
+        super().__init__(max_size)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry == None:
+            return default
+
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            # Count it as a miss instead of the hit LRUCache.get recorded
+            with self._lock:
+                self.hits -= 1
+                self.misses += 1
+            self.invalidate(key)
+            return default
+
+        return value
+
+    def put(self, key, value):
+        super().put(key, (time.monotonic() + self.ttl, value))
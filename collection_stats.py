@@ -0,0 +1,95 @@
+import psycopg
+
+# The words in a type line that are card types (everything else is a supertype or subtype)
+CARD_TYPES = ['Artifact', 'Battle', 'Creature', 'Enchantment', 'Instant', 'Kindred', 'Land', 'Planeswalker', 'Sorcery', 'Tribal']
+
+# The distinct types of ChangedCards' card. Faces are separated by // in the type line
+# and each face's types are the words before the dash (ex. Legendary Creature — Elf Druid)
+TYPES_QUERY = '''SELECT DISTINCT unnest(string_to_array(split_part(Face.TypeLine, ' — ', 1), ' ')) AS Type
+                 FROM unnest(string_to_array(ChangedCards.TypeLine, ' // ')) AS Face(TypeLine)'''
+
+# CollectionStats holds a running total of each user's quantities by
+# set, color, rarity and type so reading them doesn't need a scan of the collection.
+# Cards with several colors (or types) are counted once under each of them,
+# colorless cards are counted under C. The types of every face count
+# (ex. a Creature // Land card is counted under both)
+def stats_query(changes_query: str) -> str:
+    """
+    The query adding the quantity changes changes_query selects,
+    as (UserID, FinishCardID, Delta) rows, to CollectionStats
+    """
+    return f'''
+            WITH Changes(UserID, FinishCardID, Delta) AS (
+                {changes_query}
+            ), ChangedCards AS (
+                SELECT Changes.UserID, Changes.Delta, Cards.ID, Cards.SetID, Cards.RarityID, Cards.TypeLine FROM Changes
+                INNER JOIN FinishCards ON FinishCards.ID = Changes.FinishCardID
+                INNER JOIN Cards ON Cards.ID = FinishCards.CardID
+            ), Dimensions(UserID, Dimension, Value, Delta) AS (
+                SELECT UserID, 'total', '', Delta FROM ChangedCards
+                UNION ALL
+                SELECT UserID, 'sets', Sets.Code, Delta FROM ChangedCards
+                INNER JOIN Sets ON Sets.ID = ChangedCards.SetID
+                UNION ALL
+                SELECT UserID, 'rarities', Rarities.Rarity, Delta FROM ChangedCards
+                INNER JOIN Rarities ON Rarities.ID = ChangedCards.RarityID
+                UNION ALL
+                SELECT UserID, 'colors', COALESCE(Colors.Color, 'C'), Delta FROM ChangedCards
+                LEFT JOIN ColorCards ON ColorCards.CardID = ChangedCards.ID
+                LEFT JOIN Colors ON Colors.ID = ColorCards.ColorID
+                UNION ALL
+                SELECT UserID, 'types', Types.Type, Delta FROM ChangedCards
+                CROSS JOIN LATERAL ({TYPES_QUERY}) Types
+                WHERE Types.Type = ANY(%(card_types)s)
+            )
+            INSERT INTO CollectionStats(UserID, Dimension, Value, Quantity)
+            SELECT UserID, Dimension, Value, SUM(Delta) FROM Dimensions
+            GROUP BY UserID, Dimension, Value
+            -- Rows are locked in the order they are inserted, so two writes
+            -- for the same user always lock in the same order and never deadlock
+            ORDER BY UserID, Dimension, Value
+            ON CONFLICT (UserID, Dimension, Value)
+            DO UPDATE SET Quantity = CollectionStats.Quantity + EXCLUDED.Quantity
+            '''
+
+UPDATE_STATS_QUERY = stats_query('''SELECT %(user_id)s::INTEGER, FinishCardID, Delta
+                                    FROM unnest(%(finish_card_ids)s::INTEGER[], %(deltas)s::INTEGER[]) AS C(FinishCardID, Delta)''')
+
+REBUILD_STATS_QUERY = stats_query('''SELECT UserID, FinishCardID, Quantity FROM Collections''')
+
+def update_collection_stats(cur: psycopg.Cursor, user_id: int, changes: list[tuple[int, int]]):
+    """
+    Adds changes, a list of (FinishCardID, change in quantity), to user_id's stats.
+    Call it in the same transaction as the change to Collections
+    """
+    deltas = {}
+    for finish_card_id, delta in changes:
+        deltas[finish_card_id] = deltas.get(finish_card_id, 0) + delta
+
+    deltas = {finish_card_id: delta for finish_card_id, delta in deltas.items() if delta != 0}
+    if len(deltas) == 0:
+        return
+
+    cur.execute(UPDATE_STATS_QUERY, {
+        'user_id': user_id,
+        'finish_card_ids': list(deltas.keys()),
+        'deltas': list(deltas.values()),
+        'card_types': CARD_TYPES
+    })
+
+def rebuild_collection_stats(cur: psycopg.Cursor):
+    """Recalculates everyone's stats from scratch, for after the card data they're based on changes"""
+    cur.execute('''DELETE FROM CollectionStats''')
+    cur.execute(REBUILD_STATS_QUERY, {'card_types': CARD_TYPES})
+
+def get_collection_stats(cur: psycopg.Cursor, user_id: int) -> dict:
+    res = cur.execute('''SELECT Dimension, Value, Quantity FROM CollectionStats
+                         WHERE UserID = %s AND Quantity > 0''', (user_id,))
+
+    stats = {'total': 0, 'sets': {}, 'colors': {}, 'rarities': {}, 'types': {}}
+    for dimension, value, quantity in res.fetchall():
+        if dimension == 'total':
+            stats['total'] = quantity
+        else:
+            stats[dimension][value] = quantity
+    return stats
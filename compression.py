@@ -0,0 +1,24 @@
+import gzip
+
+# Brotli is optional, without it we only compress with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+def available_encodings() -> list[str]:
+    """The Content-Encodings we can produce, most preferred first"""
+    if brotli != None:
+        return ['br', 'gzip']
+    return ['gzip']
+
+def compress(content: bytes, encoding: str, level: int) -> bytes:
+    """
+    Compresses content for the Content-Encoding encoding.
+    level is the gzip level (0-9) or brotli quality (0-11)
+    """
+    if encoding == 'gzip':
+        return gzip.compress(content, compresslevel=level, mtime=0)
+    if encoding == 'br':
+        return brotli.compress(content, quality=level)
+    raise ValueError(f"Unsupported encoding {encoding}")
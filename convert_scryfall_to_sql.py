@@ -5,6 +5,9 @@
 # Sqlite3 is waaaay faster, for inserts but waaaay slower on the DELETES. It took about ~15 minutes or so to DELETE all the data in Sqlite3
 
 import psycopg, ijson, sys, os, timeit, requests
+from decimal import Decimal
+from migrations import migrate
+from collection_stats import rebuild_collection_stats
 
 if len(sys.argv) != 3:
     print("Expected exactly two arguments, the path to the ALL data and the path to the DEFAULT data")
@@ -46,288 +49,16 @@ now = timeit.default_timer()
 start_time = now
 
 
-cur.execute('''CREATE TABLE IF NOT EXISTS Langs
-            (
-            ID   INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Lang VARCHAR             NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Layouts
-            (
-            ID     INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Layout VARCHAR                 NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS ImageStatuses
-            (
-            ID          INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            ImageStatus VARCHAR                 NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Legalities
-            (
-            ID       INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Legality VARCHAR                 NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS SetTypes
-            (
-            ID   INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Type VARCHAR             NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Sets
-            (
-            ID            UUID    PRIMARY KEY             NOT NULL,
-            Name          VARCHAR                         NOT NULL UNIQUE,
-            TypeID        INTEGER REFERENCES SetTypes(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            Code          VARCHAR                         NOT NULL UNIQUE,
-            MtgoCode      VARCHAR                                        ,
-            TcgplayerID   VARCHAR                                        ,
-            ReleasedAt    DATE                                           ,
-            BlockCode     VARCHAR                                        ,
-            Block         VARCHAR                                        ,
-            ParentSetCode VARCHAR                                        ,
-            CardCount     VARCHAR                         NOT NULL       ,
-            PrintedSize   VARCHAR                                        ,
-            Digital       VARCHAR                         NOT NULL       ,
-            FoilOnly      VARCHAR                         NOT NULL       ,
-            NonfoilOnly   VARCHAR                         NOT NULL       ,
-            IconSVGURI    VARCHAR                         NOT NULL
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Rarities
-            (
-            ID     INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Rarity VARCHAR                 NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS BorderColors
-            (
-            ID          INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            BorderColor VARCHAR             NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Frames
-            (
-            ID    INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Frame VARCHAR                 NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Colors
-            (
-            ID    INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Color CHAR(1) NOT NULL UNIQUE
-            )
-            ''')
-
-
-# foil and nonfoil are deprecated so we don't care about them
-#
-# we don't collect the artist_ids because I don't have a good way
-# to check what artist_id is for what artist
-#
-# oracle_id, type_line, cmc (maybe others) are supposed to not be nullable
-# but sometimes they are :shrug:
-#
-# DefaultLang is the only column that's calculated
-cur.execute('''CREATE TABLE IF NOT EXISTS Cards
-               (
-               ID                      UUID        PRIMARY KEY                               NOT NULL,
-               OracleID                UUID                                                          ,
-               MtgoID                  INTEGER                                                       ,
-               MtgoFoilID              INTEGER                                                       ,
-               TcgplayerID             INTEGER                                                       ,
-               CardmarketID            INTEGER                                                       ,
-               Name                    VARCHAR                                               NOT NULL,
-               LangID                  INTEGER                 REFERENCES Langs(id) DEFERRABLE INITIALLY DEFERRED          NOT NULL,
-               DefaultLang             BOOLEAN                                               NOT NULL,
-               ReleasedAt              DATE                                                  NOT NULL,
-               LayoutID                INTEGER                 REFERENCES Layouts(id) DEFERRABLE INITIALLY DEFERRED        NOT NULL,
-               HighresImage            BOOLEAN                                               NOT NULL,
-               ImageStatusID           INTEGER                 REFERENCES ImageStatuses(id) DEFERRABLE INITIALLY DEFERRED  NOT NULL,
-               NormalImageURI          VARCHAR                                                       ,
-               ManaCost                VARCHAR                                                       ,
-               Cmc                     REAL                                                          ,
-               TypeLine                VARCHAR                                                       ,
-               OracleText              VARCHAR                                                       ,
-               Power                   VARCHAR                                                       ,
-               Toughness               VARCHAR                                                       ,
-               LegalStandardID         INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalFutureID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalHistoricID         INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalGladiatorID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalPioneerID          INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalExplorerID         INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalModernID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalLegacyID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalPauperID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalVintageID          INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalPennyID            INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalCommanderID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalBrawlID            INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalHistoricBrawlID    INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalAlchemyID          INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalPauperCommanderID  INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalDuelID             INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalOldschoolID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               LegalPremodernID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
-               Reserved                BOOLEAN                                               NOT NULL,
-               Oversized               BOOLEAN                                               NOT NULL,
-               Promo                   BOOLEAN                                               NOT NULL,
-               Reprint                 BOOLEAN                                               NOT NULL,
-               Variation               BOOLEAN                                               NOT NULL,
-               SetID                   UUID                    REFERENCES Sets(id) DEFERRABLE INITIALLY DEFERRED           NOT NULL,
-               CollectorNumber         VARCHAR                                               NOT NULL,
-               Digital                 BOOLEAN                                               NOT NULL,
-               RarityID                INTEGER                 REFERENCES Rarities(id) DEFERRABLE INITIALLY DEFERRED       NOT NULL,
-               FlavorText              VARCHAR                                                       ,
-               Artist                  VARCHAR                                                       ,
-               IllustrationID          UUID                                                          ,
-               BorderColorID           INTEGER                 REFERENCES BorderColors(id) DEFERRABLE INITIALLY DEFERRED   NOT NULL,
-               FrameID                 INTEGER                 REFERENCES Frames(id) DEFERRABLE INITIALLY DEFERRED         NOT NULL,
-               FullArt                 BOOLEAN                                               NOT NULL,
-               Textless                BOOLEAN                                               NOT NULL,
-               Booster                 BOOLEAN                                               NOT NULL,
-               StorySpotlight          BOOLEAN                                               NOT NULL,
-               UNIQUE(SetID, CollectorNumber, LangID)
-               )
-             ''')
-
-
-
-# Why UNIQUE(CardID, Name, NormalImageURI)
-# CardID + Name isn't sufficent because of SLD Stitch in Time (and others)
-# CardID + NormalImageURI isn't sufficent because NormalImageURI is NULL
-# when both "faces" are on the same side of the card (ex. aftermath cards)
-# TODO: Needs colors junction
-cur.execute('''CREATE TABLE IF NOT EXISTS Faces
-            (
-            ID             INTEGER PRIMARY KEY          GENERATED ALWAYS AS IDENTITY,
-            CardID         UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED      NOT NULL,
-            Name           VARCHAR                           NOT NULL,
-            ManaCost       VARCHAR                           NOT NULL,
-            TypeLine       VARCHAR                                   ,
-            OracleText     VARCHAR                           NOT NULL,
-            FlavorText     VARCHAR                                   ,
-            Artist         VARCHAR                                   ,
-            ArtistID       UUID                                      ,
-            IllustrationID UUID                                      ,
-            NormalImageURI VARCHAR
-            )
-            ''')
-
-
-# We _could_ make a table for the MultiverseIDs and
-# have this be forign keys to each table, but that seems
-# unnecessary
-cur.execute('''CREATE TABLE IF NOT EXISTS MultiverseIDCards
-            (
-            ID           INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            CardID       UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            MultiverseID INTEGER                      NOT NULL
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS ColorCards
-            (
-            ID      INTEGER  PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            CardID  UUID     REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            ColorID INTEGER  REFERENCES Colors(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            UNIQUE(CardID, ColorID)
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS ColorIdentityCards
-            (
-            ID      INTEGER  PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            CardID  UUID     REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            ColorID INTEGER  REFERENCES Colors(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            UNIQUE(CardID, ColorID)
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Keywords
-            (
-            ID      INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Keyword VARCHAR NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS KeywordCards
-            (
-            ID        INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            CardID    UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            KeywordID INTEGER REFERENCES Keywords(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            UNIQUE(CardID, KeywordID)
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Games
-            (
-            ID   INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Game VARCHAR NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS GameCards
-            (
-            ID     INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            CardID UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            GameID INTEGER REFERENCES Games(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            UNIQUE(CardID, GameID)
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Finishes
-            (
-            ID     INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Finish VARCHAR NOT NULL UNIQUE
-            )
-            ''')
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS FinishCards
-            (
-            ID       INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            CardID   UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            FinishID INTEGER REFERENCES Finishes(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            UNIQUE(CardID, FinishID)
-            )
-            ''')
-
-
-print(f"Create tables took {timeit.default_timer() - now:.2f} seconds")
+# Creates (or updates) the tables, see migrations.py
+migrate(con)
+
+print(f"Migrations took {timeit.default_timer() - now:.2f} seconds")
 now = timeit.default_timer()
 
 cur.execute('DELETE FROM Sets')
 cur.execute('DELETE FROM Cards')
 cur.execute('DELETE FROM Faces')
+cur.execute('DELETE FROM Prices')
 
 print(f"DELETE tables took {timeit.default_timer() - now:.2f} seconds")
 now = timeit.default_timer()
@@ -513,7 +244,24 @@ now = timeit.default_timer()
 all_data_file.seek(0)
 all_data = ijson.items(all_data_file, 'item', use_float=True)
 num_cards = index + 1
-with cur.copy("COPY Cards (ID, OracleID, MtgoID, MtgoFoilID, TcgplayerID, CardmarketID, Name, LangID, DefaultLang, ReleasedAt, LayoutID, HighresImage, ImageStatusID, NormalImageURI, ManaCost, Cmc, TypeLine, OracleText, Power, Toughness, LegalStandardID, LegalFutureID, LegalHistoricID, LegalGladiatorID, LegalPioneerID, LegalExplorerID, LegalModernID, LegalLegacyID, LegalPauperID, LegalVintageID, LegalPennyID, LegalCommanderID, LegalBrawlID, LegalHistoricBrawlID, LegalAlchemyID, LegalPauperCommanderID, LegalDuelID, LegalOldschoolID, LegalPremodernID, Reserved, Oversized, Promo, Reprint, Variation, SetID, CollectorNumber, Digital, RarityID, FlavorText, Artist, IllustrationID, BorderColorID, FrameID, FullArt, Textless, Booster, StorySpotlight) FROM STDIN") as copy:
+# Maps (set_id, collector_number) -> PrintingID
+printing_ids = {}
+
+# The (usd, eur, tix) prices that go with each finish
+FINISH_PRICE_KEYS = {
+    'nonfoil': ('usd', 'eur', 'tix'),
+    'foil': ('usd_foil', 'eur_foil', None),
+    'etched': ('usd_etched', 'eur_etched', None)
+}
+
+def to_cents(price: str | None) -> int | None:
+    if price == None:
+        return None
+    return int(Decimal(price) * 100)
+
+# Maps (card_id, finish) -> (set_id, usd, eur, tix)
+finish_prices = {}
+with cur.copy("COPY Cards (ID, OracleID, MtgoID, MtgoFoilID, TcgplayerID, CardmarketID, Name, LangID, DefaultLang, ReleasedAt, LayoutID, HighresImage, ImageStatusID, NormalImageURI, ManaCost, Cmc, TypeLine, OracleText, Power, Toughness, LegalStandardID, LegalFutureID, LegalHistoricID, LegalGladiatorID, LegalPioneerID, LegalExplorerID, LegalModernID, LegalLegacyID, LegalPauperID, LegalVintageID, LegalPennyID, LegalCommanderID, LegalBrawlID, LegalHistoricBrawlID, LegalAlchemyID, LegalPauperCommanderID, LegalDuelID, LegalOldschoolID, LegalPremodernID, Reserved, Oversized, Promo, Reprint, Variation, SetID, CollectorNumber, Digital, RarityID, FlavorText, Artist, IllustrationID, BorderColorID, FrameID, FullArt, Textless, Booster, StorySpotlight, PrintingID) FROM STDIN") as copy:
     for index, card in enumerate(all_data):
         if index % 1000 == 0:
             print(f"{index}/{num_cards} {index/num_cards:.2f}")
@@ -563,6 +311,8 @@ with cur.copy("COPY Cards (ID, OracleID, MtgoID, MtgoFoilID, TcgplayerID, Cardma
 
         default = card['id'] in default_set
 
+        printing_id = printing_ids.setdefault((set_id, card['collector_number']), len(printing_ids) + 1)
+
         values = (
                 card['id'],
                 card.get('oracle_id'),
@@ -620,7 +370,8 @@ with cur.copy("COPY Cards (ID, OracleID, MtgoID, MtgoFoilID, TcgplayerID, Cardma
                 card['full_art'],
                 card['textless'],
                 card['booster'],
-                card['story_spotlight']
+                card['story_spotlight'],
+                printing_id
                 )
 
         res = copy.write_row(values)
@@ -646,6 +397,12 @@ with cur.copy("COPY Cards (ID, OracleID, MtgoID, MtgoFoilID, TcgplayerID, Cardma
             finish_id = finishes_id_map[finish]
             finish_cards.add((card['id'], finish_id))
 
+            prices = card.get('prices') or {}
+            cents = tuple(to_cents(prices.get(key)) if key != None else None for key in FINISH_PRICE_KEYS.get(finish, (None, None, None)))
+            # Most printings (especially non-English ones) don't have any prices
+            if cents != (None, None, None):
+                finish_prices[(card['id'], finish)] = (set_id,) + cents
+
 # add_new is similar to a bluk insert_or_select, but we need to
 # return a value in insert_or_select and this is probably faster than
 # reusing insert_or_select
@@ -672,6 +429,17 @@ add_new(keyword_cards, 'KeywordCards', ("CardID", "KeywordID"))
 add_new(game_cards, 'GameCards', ("CardID", "GameID"))
 add_new(finish_cards, 'FinishCards', ("CardID", "FinishID"))
 
+# Prices are per FinishCard, so this has to wait until they all have IDs
+cur.execute('''SELECT FinishCards.ID, FinishCards.CardID, Finishes.Finish FROM FinishCards
+               INNER JOIN Finishes ON Finishes.ID = FinishCards.FinishID''')
+finish_card_rows = cur.fetchall()
+
+with cur.copy("COPY Prices (FinishCardID, SetID, USD, EUR, Tix) FROM STDIN") as copy:
+    for finish_card_id, card_id, finish in finish_card_rows:
+        prices = finish_prices.get((str(card_id), finish))
+        if prices != None:
+            copy.write_row((finish_card_id,) + prices)
+
 print(f"INSERT (cards, and card junction tables) took {timeit.default_timer() - now:.2f} seconds")
 now = timeit.default_timer()
 
@@ -682,6 +450,19 @@ for face in faces:
 print(f"INSERT faces took {timeit.default_timer() - now:.2f} seconds")
 now = timeit.default_timer()
 
+# A card's set, colors, rarity or types can change between imports
+rebuild_collection_stats(cur)
+
+print(f"Rebuilding collection stats took {timeit.default_timer() - now:.2f} seconds")
+now = timeit.default_timer()
+
+# This is committed along with the cards, so the new version
+# is never visible before the new data is
+cur.execute('''INSERT INTO CatalogVersion (ID, Version, ImportedAt)
+               VALUES (1, 1, now())
+               ON CONFLICT (ID) DO UPDATE
+               SET Version = CatalogVersion.Version + 1, ImportedAt = now()''')
+
 now = timeit.default_timer()
 con.commit()
 print(f"Commit took {timeit.default_timer() - now:.2f} seconds")
@@ -1,6 +1,7 @@
 #!/usr/bin/env bash
 
 export FLASK_APP=main
-export FLASK_ENV=development
+export FLASK_DEBUG=1
 source ./env/bin/activate
+python migrations.py
 python -m flask run
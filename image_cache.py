@@ -0,0 +1,150 @@
+import os, io, hashlib, mimetypes, tempfile, threading
+import urllib.request
+from urllib.parse import urlparse
+
+# Pillow is optional, without it thumbnails are just the full image
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+class ImageFetchException(Exception):
+    pass
+
+class HTTPFetcher:
+    """Downloads images over the network"""
+    def __init__(self, timeout: float = 10.0):
+        self.timeout = timeout
+
+    def fetch(self, url: str) -> bytes:
+        req = urllib.request.Request(url, headers={'User-Agent': 'mtg-collection-tracker'})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                return response.read()
+        except OSError as e:
+            raise ImageFetchException(f"Couldn't fetch {url}: {e}")
+
+class DirectoryFetcher:
+    """
+    Reads images out of a local directory instead of the network, for tests and offline use.
+    Only the path of the URL is used, so https://cards.scryfall.io/normal/front/a/b/x.jpg?123
+    is read from <directory>/normal/front/a/b/x.jpg
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def fetch(self, url: str) -> bytes:
+        # normpath on an absolute path can't go above / so this stays inside directory
+        path = os.path.normpath(urlparse(url).path).lstrip('/')
+        try:
+            with open(os.path.join(self.directory, path), 'rb') as f:
+                return f.read()
+        except OSError as e:
+            raise ImageFetchException(f"Couldn't fetch {url}: {e}")
+
+class CachedImage:
+    def __init__(self, path: str, digest: str):
+        self.path = path
+        self.digest = digest
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        # Type declarations
+        self.path: str
+        self.digest: str
+        self.mimetype: str
+
+class ImageCache:
+    """
+    Fetches each image once and keeps it on disk under the hash of its content.
+    Layout of cache_dir:
+        urls/<sha256 of url>             the object path the url was saved as
+        objects/<ab>/<sha256>.<ext>      the images
+        thumbnails/<width>/<ab>/<sha256>.jpg
+    Everything is written to a temp file and renamed into place, so
+    several workers can share one cache_dir
+    """
+    def __init__(self, cache_dir: str, fetcher, thumbnail_width: int = 250):
+        self.cache_dir = cache_dir
+        self.fetcher = fetcher
+        self.thumbnail_width = thumbnail_width
+
+        # Stops two threads from fetching (or resizing) the same image at once,
+        # keys are spread over a fixed number of locks so this doesn't grow
+        self._locks = [threading.Lock() for _ in range(64)]
+
+    def _lock_for(self, key: str) -> threading.Lock:
+        return self._locks[int(hashlib.sha256(key.encode()).hexdigest()[:8], 16) % len(self._locks)]
+
+    def _write(self, path: str, content: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def _lookup(self, url: str) -> CachedImage | None:
+        url_path = os.path.join(self.cache_dir, 'urls', hashlib.sha256(url.encode()).hexdigest())
+        try:
+            with open(url_path) as f:
+                object_path = f.read()
+        except FileNotFoundError:
+            return None
+
+        path = os.path.join(self.cache_dir, 'objects', object_path)
+        if not os.path.isfile(path):
+            return None
+        digest = os.path.splitext(os.path.basename(object_path))[0]
+        return CachedImage(path, digest)
+
+    def get(self, url: str) -> CachedImage:
+        """The cached copy of the image at url, fetching it if we don't have it yet"""
+        image = self._lookup(url)
+        if image != None:
+            return image
+
+        with self._lock_for(url):
+            # Someone else may have fetched it while we were waiting
+            image = self._lookup(url)
+            if image != None:
+                return image
+
+            content = self.fetcher.fetch(url)
+            digest = hashlib.sha256(content).hexdigest()
+            ext = os.path.splitext(urlparse(url).path)[1].lower() or '.jpg'
+            object_path = f'{digest[:2]}/{digest}{ext}'
+
+            path = os.path.join(self.cache_dir, 'objects', object_path)
+            # Identical images from different URLs are only stored once
+            if not os.path.isfile(path):
+                self._write(path, content)
+            self._write(os.path.join(self.cache_dir, 'urls', hashlib.sha256(url.encode()).hexdigest()), object_path.encode())
+
+            return CachedImage(path, digest)
+
+    def get_thumbnail(self, url: str) -> CachedImage:
+        """A thumbnail_width wide copy of the image at url"""
+        image = self.get(url)
+        if Image == None:
+            return image
+
+        path = os.path.join(self.cache_dir, 'thumbnails', str(self.thumbnail_width), image.digest[:2], f'{image.digest}.jpg')
+        # The thumbnail is named after the full image, so it has its own digest for ETags
+        thumbnail_digest = f'{image.digest}-{self.thumbnail_width}'
+        if os.path.isfile(path):
+            return CachedImage(path, thumbnail_digest)
+
+        with self._lock_for(path):
+            if not os.path.isfile(path):
+                with Image.open(image.path) as full_image:
+                    thumbnail = full_image.convert('RGB')
+                # Keeps the aspect ratio, the height limit is just there to make it never apply
+                thumbnail.thumbnail((self.thumbnail_width, self.thumbnail_width * 10), Image.LANCZOS)
+                output = io.BytesIO()
+                thumbnail.save(output, 'JPEG', quality=85, optimize=True, progressive=True)
+                self._write(path, output.getvalue())
+
+        return CachedImage(path, thumbnail_digest)
@@ -1,86 +1,223 @@
-from flask import Flask, request, url_for, redirect, abort, render_template_string, flash
+from flask import Flask, request, url_for, redirect, abort, render_template, flash, g, session, stream_with_context, send_file
 from urllib.parse import urlparse, urljoin
+from werkzeug.http import is_resource_modified
 from flask_login import LoginManager, login_required, login_user, logout_user
+from psycopg_pool import ConnectionPool
 import json, sqlite3, psycopg
+import uuid, csv, io, re
 import hashlib, binascii
 import flask_login
 import secrets
 import config
+import threading, time
+from types import MappingProxyType
+from cache import LRUCache, TTLCache
+from static_assets import StaticAssets
+from compression import available_encodings, compress
+from image_cache import ImageCache, HTTPFetcher, DirectoryFetcher, ImageFetchException
+from migrations import check_schema_version
+from password_hashing import PasswordHashingPool, HashingPoolFullException
+from collection_stats import update_collection_stats, get_collection_stats
+from metrics import registry, MetricsCursor, track_queries, record_request
+from page_cursor import InvalidCursorException, encode_page_cursor, keyset_condition, keyset_params
+import os
 from datetime import datetime
 from argon2 import PasswordHasher
 from argon2.exceptions import VerifyMismatchError
 
 login_manager = LoginManager()
 
-app = Flask(__name__)
+# /static is served by static_file below instead of Flask's default handler
+app = Flask(__name__, static_folder=None)
 login_manager.init_app(app)
 
 HASH_FUNCTION = 'SHA3-512'
 app.config['SECRET_KEY'] = config.SECRET_KEY
 
-def get_database_connection():
-    con = psycopg.connect(user = config.DB_USER, password = config.DB_PASSWORD, host = config.DB_HOST, port = config.DB_PORT)
-    return con
-
-con = get_database_connection()
-cur = con.cursor()
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Users
-            (
-            ID           INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            Username     VARCHAR NOT NULL,
-            PasswordHash VARCHAR NOT NULL,
-            UNIQUE(Username)
-            )
-            ''')
-
-# Why aren't we salting these hashes?
-# https://security.stackexchange.com/questions/209936/do-i-need-to-use-salt-with-api-key-hashing
-cur.execute('''CREATE TABLE IF NOT EXISTS APITokens
-            (
-            ID         INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            UserID     INTEGER     REFERENCES Users(ID) NOT NULL,
-            TokenHash  BYTEA       UNIQUE NOT NULL,
-            ValidUntil TIMESTAMPTZ
-            )
-            ''')
-
-res = cur.execute("""
-            SELECT *
-              FROM pg_type typ
-                   INNER JOIN pg_namespace nsp
-                              ON nsp.oid = typ.typnamespace
-              WHERE nsp.nspname = current_schema()
-                    AND typ.typname = 'condition'""")
-
-# Create condition type if it doesn't exist
-condition_type = res.fetchone()
-if condition_type == None:
-    cur.execute("""CREATE TYPE condition AS ENUM
-                ('Damaged', 'Heavily Played', 'Moderately Played', 'Lightly Played', 'Near Mint')""")
-
-
-cur.execute('''CREATE TABLE IF NOT EXISTS Collections
-            (
-            ID           INTEGER   PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
-            UserID       INTEGER   REFERENCES Users(ID)       DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            FinishCardID INTEGER   REFERENCES FinishCards(ID) DEFERRABLE INITIALLY DEFERRED NOT NULL,
-            Condition    condition NOT NULL,
-            Signed       BOOLEAN   NOT NULL,
-            Altered      BOOLEAN   NOT NULL,
-            Notes        VARCHAR   NOT NULL,
-            Quantity     INTEGER   NOT NULL,
-            UNIQUE(UserID, FinishCardID, Condition, Signed, Altered, Notes)
-            )
-            ''')
-
-ph = PasswordHasher()
-password_hash = ph.hash('foo')
-
-cur.execute('''INSERT INTO Users(Username, PasswordHash) VALUES(%s, %s) ON CONFLICT DO NOTHING''', ('me', password_hash))
-
-con.commit()
+# The pool settings are optional in config.py so older configs keep working
+# max_size bounds how many connections a single worker will ever hold open and
+# timeout is how long (in seconds) a request waits for one before giving up
+DB_CONNECTION_KWARGS = {'user': config.DB_USER, 'password': config.DB_PASSWORD, 'host': config.DB_HOST, 'port': config.DB_PORT}
+# MetricsCursor counts the queries each request makes (see record_request_metrics)
+pool = ConnectionPool(kwargs = DB_CONNECTION_KWARGS | {'cursor_factory': MetricsCursor},
+                      min_size = getattr(config, 'DB_POOL_MIN_SIZE', 1),
+                      max_size = getattr(config, 'DB_POOL_MAX_SIZE', 10),
+                      timeout = getattr(config, 'DB_POOL_TIMEOUT', 30.0),
+                      check = ConnectionPool.check_connection,
+                      open = True)
+
+# Checks a connection out of the pool the first time it's needed in a request
+# and hands back the same one for the rest of that request.
+# It's returned to the pool in return_database_connection
+def get_database_connection() -> psycopg.Connection:
+    if 'db_con' not in g:
+        g.db_con = pool.getconn()
+    return g.db_con
+
+def release_database_connection():
+    """
+    Returns the request's connection to the pool before the request ends, for routes
+    about to do slow work that doesn't need it. Anything uncommitted is thrown away
+    and the next get_database_connection checks out a connection again
+    """
+    con = g.pop('db_con', None)
+    if con == None:
+        return
+
+    # Anything the route didn't commit is thrown away, same as when every
+    # request had its own connection that was dropped at the end
+    try:
+        con.rollback()
+    except psycopg.Error:
+        # The pool notices broken connections and replaces them
+        pass
+    pool.putconn(con)
+
+@app.teardown_appcontext
+def return_database_connection(exception):
+    release_database_connection()
+
+@app.before_request
+def start_request_metrics():
+    g.request_started_at = time.perf_counter()
+    g.query_stats = track_queries()
+
+# Registered before compress_api_response so it runs after it
+# (and sees the compressed size). Streamed responses are only timed
+# until they start streaming
+@app.after_request
+def record_request_metrics(response):
+    started_at = g.get('request_started_at')
+    if started_at == None:
+        return response
+
+    # content_length is None for streamed responses, their size isn't known up front
+    record_request(request.endpoint or 'unmatched', request.method, response.status_code,
+                   time.perf_counter() - started_at, request.content_length, response.content_length, g.get('query_stats'))
+    return response
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Request and database metrics for this worker in the Prometheus text format"""
+    return app.response_class(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# The tables are created by migrations.py, which is run once before starting
+# the app. Workers only make sure it's been run
+with pool.connection() as con:
+    check_schema_version(con.cursor())
+
+# Changing these only affects new hashes, old ones are rehashed the next time their user logs in.
+# The defaults are argon2-cffi's
+ph = PasswordHasher(time_cost = getattr(config, 'ARGON2_TIME_COST', 3),
+                    memory_cost = getattr(config, 'ARGON2_MEMORY_COST', 65536),
+                    parallelism = getattr(config, 'ARGON2_PARALLELISM', 4))
+
+# Hashing is slow on purpose, so it gets a few threads of its own and
+# logins past what those can keep up with are turned away
+password_hashing_pool = PasswordHashingPool(ph,
+                                            workers = getattr(config, 'PASSWORD_HASH_WORKERS', 2),
+                                            max_queued = getattr(config, 'PASSWORD_HASH_MAX_QUEUED', 8))
+
+def password_hashing_busy(template_name: str):
+    """The response for when password_hashing_pool turns a login or signup away"""
+    flash("Too many people are logging in right now, try again in a moment")
+    response = app.response_class(render_template(template_name), status=503)
+    response.headers['Retry-After'] = '1'
+    return response
+
+# How often (in seconds) each worker checks if the catalog has been re-imported
+CATALOG_VERSION_CHECK_INTERVAL = getattr(config, 'CATALOG_VERSION_CHECK_INTERVAL', 60)
+
+catalog_version = None
+catalog_version_checked_at = None
+# Only held while the version (and caches) are swapped, never while waiting on the database
+catalog_version_lock = threading.Lock()
+
+# Caches of catalog data, all of them are cleared when the catalog version changes
+card_cache = LRUCache(getattr(config, 'CARD_CACHE_SIZE', 10000))
+catalog_caches = [card_cache]
+
+CATALOG_VERSION_QUERY = '''SELECT Version, ImportedAt FROM CatalogVersion'''
+
+def catalog_version_is_current() -> bool:
+    """If we've asked the database for the catalog version in the last CATALOG_VERSION_CHECK_INTERVAL seconds"""
+    return catalog_version_checked_at != None and time.monotonic() - catalog_version_checked_at < CATALOG_VERSION_CHECK_INTERVAL
+
+def get_catalog_version() -> tuple[int, datetime | None]:
+    """
+    Returns (version, imported_at) of the card catalog.
+    The database is only asked (using the request's connection) once
+    every CATALOG_VERSION_CHECK_INTERVAL seconds
+    """
+    if catalog_version_is_current():
+        return catalog_version
+
+    # Several threads can end up asking at once, which is cheaper than making them
+    # wait on each other while holding (or waiting for) pool connections
+    cur = get_database_connection().cursor()
+    res = cur.execute(CATALOG_VERSION_QUERY)
+    return set_catalog_version(res.fetchone())
+
+def set_catalog_version(row: tuple | None) -> tuple[int, datetime | None]:
+    """Records a row read with CATALOG_VERSION_QUERY, clearing the catalog caches if the version changed"""
+    global catalog_version, catalog_version_checked_at
+
+    # The catalog has never been imported
+    if row == None:
+        row = (0, None)
+
+    with catalog_version_lock:
+        # A slow check can finish after a faster one saw a newer import, keep the newer one
+        if catalog_version != None and catalog_version[1] != None and row[1] != None and row[1] < catalog_version[1]:
+            catalog_version_checked_at = time.monotonic()
+            return catalog_version
+
+        if catalog_version != None and row[0] != catalog_version[0]:
+            for cache in catalog_caches:
+                cache.clear()
+
+        catalog_version = row
+        catalog_version_checked_at = time.monotonic()
+        return catalog_version
+
+class LookupTables:
+    """
+    Read only copies of the small tables that map names to IDs.
+    They only change when the catalog is imported, so we load them once
+    per catalog version instead of querying them on every request
+    """
+    def __init__(self, cur: psycopg.Cursor, catalog_version: int):
+        self.catalog_version = catalog_version
+
+        res = cur.execute('''SELECT Finish, ID FROM Finishes''')
+        self.finish_ids = MappingProxyType(dict(res.fetchall()))
+
+        res = cur.execute('''SELECT Lang, ID FROM Langs''')
+        self.lang_ids = MappingProxyType(dict(res.fetchall()))
+
+        res = cur.execute('''SELECT unnest(enum_range(NULL::condition))::VARCHAR''')
+        self.conditions = frozenset(row[0] for row in res.fetchall())
+
+        # Type declarations
+        self.catalog_version: int
+        self.finish_ids: MappingProxyType
+        self.lang_ids: MappingProxyType
+        self.conditions: frozenset
+
+lookup_tables = None
+
+def get_lookup_tables(cur: psycopg.Cursor) -> LookupTables:
+    global lookup_tables
+
+    version, _ = get_catalog_version()
+    # Reading and replacing lookup_tables are both atomic, so at worst two
+    # threads both load the tables and one copy is thrown away
+    tables = lookup_tables
+    if tables == None or tables.catalog_version != version:
+        tables = LookupTables(cur, version)
+        lookup_tables = tables
+
+    return tables
 
 class User:
     def __init__(self, id, username):
@@ -93,6 +230,89 @@ class User:
     def get_id(self):
         return self.id
 
+# Everything in static/ is loaded (and precompressed) once at startup and
+# served from memory. url_for('static', ...) hands out fingerprinted URLs
+# (ex. /static/js/collection.<hash>.js) that can be cached forever
+static_assets = StaticAssets(os.path.join(app.root_path, 'static'))
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    if endpoint == 'static' and 'filename' in values:
+        values['filename'] = static_assets.url_path(values['filename'])
+
+@app.before_request
+def reload_static_assets():
+    # Pick up edits while developing (see dev.sh). Only pages link to static
+    # files, and only the files that changed are compressed again
+    if app.debug and request.endpoint != 'static' and not request.path.startswith('/api/'):
+        static_assets.reload_changed()
+
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    asset, fingerprinted = static_assets.find(filename)
+    if asset == None:
+        return abort(404)
+
+    # Only offer what this asset has, brotli is optional and tiny files aren't compressed
+    encoding = request.accept_encodings.best_match([encoding for encoding in ('br', 'gzip') if encoding in asset.encodings], default='identity')
+
+    response = app.response_class(asset.encodings[encoding], mimetype=asset.mimetype)
+    if encoding != 'identity':
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.set_etag(asset.etag(encoding))
+
+    if fingerprinted:
+        # The URL changes whenever the file does
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        # Old style URLs have to be checked every time,
+        # but that's a cheap 304 if nothing changed
+        response.headers['Cache-Control'] = 'no-cache'
+
+    # Answers If-None-Match with a 304
+    return response.make_conditional(request)
+
+# API responses at least this many bytes long are compressed if the client accepts it
+API_COMPRESSION_MIN_SIZE = getattr(config, 'API_COMPRESSION_MIN_SIZE', 1024)
+# Maps Content-Encoding -> level. Lower is cheaper on CPU, higher saves more bytes
+API_COMPRESSION_LEVELS = {
+    'gzip': getattr(config, 'API_GZIP_LEVEL', 6),
+    'br': getattr(config, 'API_BROTLI_QUALITY', 4)
+}
+
+@app.after_request
+def compress_api_response(response):
+    if not request.path.startswith('/api/'):
+        return response
+    return compress_response(response, request.accept_encodings)
+
+def compress_response(response, accept_encodings):
+    """Compresses response (in place) for a client that sent accept_encodings"""
+    response.vary.add('Accept-Encoding')
+
+    # Streamed responses are never read into memory, so we leave those alone
+    if response.is_streamed or response.direct_passthrough or response.content_encoding or response.status_code != 200:
+        return response
+
+    encoding = accept_encodings.best_match(available_encodings())
+    if encoding == None:
+        return response
+
+    body = response.get_data()
+    if len(body) < API_COMPRESSION_MIN_SIZE:
+        return response
+
+    response.set_data(compress(body, encoding, API_COMPRESSION_LEVELS[encoding]))
+    response.content_encoding = encoding
+    return response
+
+# Compile the page templates now so the first request for each page doesn't have to.
+# Jinja keeps them cached, it only checks the files for changes when
+# running in debug mode (see dev.sh)
+for template_name in ['signup.html', 'login.html', 'collection.html', 'collection_add.html', 'generate_token.html', 'deckbuilder.html']:
+    app.jinja_env.get_template(template_name)
+
 # Matches the function name that you want to go to
 login_manager.login_view = "login"
 
@@ -106,8 +326,22 @@ def is_safe_url(target):
     return test_url.scheme in ('http', 'https') and \
            ref_url.netloc == test_url.netloc
 
+# How often (in seconds) a logged in user is checked against the database.
+# In between the username comes from the (signed) session cookie
+USER_REVALIDATE_INTERVAL = getattr(config, 'USER_REVALIDATE_INTERVAL', 300)
+
+def remember_user(user: User):
+    """Stores the user in the session so load_user doesn't need the database"""
+    session['user'] = [user.id, user.username, time.time()]
+
 @login_manager.user_loader
 def load_user(user_id):
+    remembered_user = session.get('user')
+    if remembered_user != None:
+        remembered_id, username, validated_at = remembered_user
+        if remembered_id == user_id and time.time() - validated_at < USER_REVALIDATE_INTERVAL:
+            return User(user_id, username)
+
     con = get_database_connection()
     cur = con.cursor()
 
@@ -117,11 +351,13 @@ def load_user(user_id):
 
     row = res.fetchone()
     if row == None:
+        session.pop('user', None)
         return None
 
     username = row[0]
 
     user = User(user_id, username)
+    remember_user(user)
     return user
 
 @app.route("/")
@@ -172,37 +408,35 @@ def get_user_id_by_username(username: str, cur: psycopg.Cursor):
 class NotFoundException(Exception):
     pass
 
+# The ORDER BY is a quick and dirty way to make sure that we get the front image first.
+# This works because the URI follows the format
+# https://cards.scryfall.io/normal/<front or back>/...
+# So we just sort it so front is first
+# TODO: Make this less jank (might require adding which face is which when converting the JSON)
+CARD_QUERY = '''
+             SELECT Cards.ID, Cards.Name, Finishes.Finish, Cards.CollectorNumber, Sets.Code, Cards.NormalImageURI, Faces.NormalImageURI, Langs.Lang FROM Cards
+             INNER JOIN FinishCards ON FinishCards.CardID = Cards.ID
+             INNER JOIN Finishes ON FinishCards.FinishID = Finishes.ID
+             LEFT  JOIN Faces ON Faces.CardID = Cards.ID
+             INNER JOIN Sets ON Sets.ID = Cards.SetID
+             INNER JOIN Langs ON Langs.ID = Cards.LangID
+             WHERE Cards.ID = ANY(%s)
+             ORDER BY Cards.ID, Faces.NormalImageURI DESC
+             '''
+
 class Card:
-    def __init__(self, scryfall_id: str):
+    def __init__(self, scryfall_id: str, rows: list[tuple]):
+        """Builds a Card from the rows CARD_QUERY returned for it. Use get_cards to load cards"""
         self.scryfall_id = scryfall_id
-        # The ORDER BY is a quick and dirty way to make sure that we get the front image first.
-        # This works because the URI follows the format
-        # https://cards.scryfall.io/normal/<front or back>/...
-        # So we just sort it so front is first
-        # TODO: Make this less jank (might require adding which face is which when converting the JSON)
-        res = cur.execute('''
-                      SELECT Cards.Name, Finishes.Finish, Cards.CollectorNumber, Sets.Code, Cards.NormalImageURI, Faces.NormalImageURI, Langs.Lang FROM Cards
-                      INNER JOIN FinishCards ON FinishCards.CardID = Cards.ID
-                      INNER JOIN Finishes ON FinishCards.FinishID = Finishes.ID
-                      LEFT  JOIN Faces ON Faces.CardID = Cards.ID
-                      INNER JOIN Sets ON Sets.ID = Cards.SetID
-                      INNER JOIN Langs ON Langs.ID = Cards.LangID
-                      WHERE Cards.ID = %s
-                      ORDER BY Faces.NormalImageURI DESC
-                      ''', (scryfall_id,))
-
-        rows = res.fetchall()
-        if len(rows) == 0:
-            raise NotFoundException("Couldn't find card with ID \"{scryfall_id}\"")
 
         # We use set() to dedupe because order doesn't matter
-        self.finishes = list(set(row[1] for row in rows))
+        self.finishes = list(set(row[2] for row in rows))
 
-        cards_image_uri = rows[0][4]
+        cards_image_uri = rows[0][5]
 
         # We don't use set() because order _does_ matter
         faces_image_uris = []
-        for row in [row[5] for row in rows]:
+        for row in [row[6] for row in rows]:
             if row not in faces_image_uris:
                 faces_image_uris.append(row)
 
@@ -216,10 +450,10 @@ class Card:
         # so we just pull out the first one
         card = rows[0]
 
-        self.name = card[0]
-        self.collector_number = card[2]
-        self.set_code = card[3]
-        self.lang = card[6]
+        self.name = card[1]
+        self.collector_number = card[3]
+        self.set_code = card[4]
+        self.lang = card[7]
 
         # Type declarations
         self.scryfall_id: str
@@ -230,31 +464,167 @@ class Card:
         self.lang: str
         self.image_uris: list | None
 
+    def cached_image_uris(self, size: str) -> list | None:
+        if self.image_uris == None:
+            return None
+        return [f'/images/{size}/{self.scryfall_id}/{face}' for face in range(len(self.image_uris))]
+
     def get_dict(self):
         return_card = {
+            'scryfall_id': self.scryfall_id,
             'name': self.name,
             'finishes': self.finishes,
             'collector_number': self.collector_number,
             'set': self.set_code,
             'image_uris': self.image_uris,
+            # The same images, served from our image cache
+            'cached_image_uris': self.cached_image_uris('normal'),
+            'thumbnail_uris': self.cached_image_uris('thumbnail'),
             'lang': self.lang
         }
         return return_card
 
-def get_user_id_from_token(cur: psycopg.Cursor, token: str) -> tuple[int, None] | tuple[None, dict]:
-    hasher = hashlib.new(HASH_FUNCTION)
-    hasher.update(binascii.unhexlify(token))
-    hashed_token_bytes = hasher.digest()
+def get_cards(scryfall_ids: list[str], cur: psycopg.Cursor) -> tuple[list[Card], list[str]]:
+    """
+    Loads every card in scryfall_ids with a single query.
+    Returns the cards in the same order as scryfall_ids (duplicates included)
+    and a list of the IDs that don't exist
+    """
+    card_uuids = parse_card_ids(scryfall_ids)
+
+    rows = []
+    if len(card_uuids) != 0:
+        res = cur.execute(CARD_QUERY, (list(set(card_uuids.values())),))
+        rows = res.fetchall()
 
-    cur.execute('''SELECT Users.ID, APITokens.ValidUntil FROM Users
-                   INNER JOIN APITokens ON APITokens.UserID = Users.ID
-                   WHERE APITokens.TokenHash = %s''', (hashed_token_bytes, ))
+    return cards_from_rows(scryfall_ids, card_uuids, rows)
 
-    row = cur.fetchone()
-    if row == None:
+def parse_card_ids(scryfall_ids: list[str]) -> dict[str, uuid.UUID]:
+    """
+    Maps each of scryfall_ids that's a UUID to its parsed UUID.
+    Anything that isn't a UUID can't be in the database and would make
+    postgres reject the whole query, so it's left out (and ends up in not_found)
+    """
+    card_uuids = {}
+    for scryfall_id in scryfall_ids:
+        try:
+            card_uuids[scryfall_id] = uuid.UUID(scryfall_id)
+        except (ValueError, TypeError, AttributeError):
+            pass
+    return card_uuids
+
+def cards_from_rows(scryfall_ids: list[str], card_uuids: dict[str, uuid.UUID], rows: list[tuple]) -> tuple[list[Card], list[str]]:
+    """The second half of get_cards, rows are what CARD_QUERY returned for card_uuids"""
+    rows_by_id = {}
+    for row in rows:
+        rows_by_id.setdefault(row[0], []).append(row)
+
+    cards = []
+    not_found = []
+    for scryfall_id in scryfall_ids:
+        rows = rows_by_id.get(card_uuids.get(scryfall_id))
+        if rows == None:
+            not_found.append(scryfall_id)
+        else:
+            cards.append(Card(scryfall_id, rows))
+
+    return cards, not_found
+
+class CardDictsLookup:
+    """
+    get_card_dicts split up around its one query, so asgi.py can run the same
+    lookup with an async cursor:
+        lookup = CardDictsLookup(scryfall_ids)
+        rows = (run CARD_QUERY with lookup.query_params) if lookup.needs_query else []
+        cards, not_found = lookup.finish(rows)
+    Check the catalog version first, so card_cache doesn't hand out cards from an old catalog
+    """
+    def __init__(self, scryfall_ids: list[str]):
+        # Only strings can be IDs (everything else can't be used as a cache key either)
+        self.not_found = [scryfall_id for scryfall_id in scryfall_ids if type(scryfall_id) != str]
+        self.scryfall_ids = [scryfall_id for scryfall_id in scryfall_ids if type(scryfall_id) == str]
+
+        self.card_dicts = {}
+        self.missing_ids = []
+        for scryfall_id in self.scryfall_ids:
+            card_dict = card_cache.get(scryfall_id)
+            if card_dict == None:
+                self.missing_ids.append(scryfall_id)
+            else:
+                self.card_dicts[scryfall_id] = card_dict
+
+        self.card_uuids = parse_card_ids(self.missing_ids)
+        self.needs_query = len(self.card_uuids) != 0
+        self.query_params = (list(set(self.card_uuids.values())),)
+
+        # Type declarations
+        self.not_found: list
+        self.scryfall_ids: list[str]
+        self.card_dicts: dict[str, dict]
+        self.missing_ids: list[str]
+        self.card_uuids: dict[str, uuid.UUID]
+        self.needs_query: bool
+        self.query_params: tuple
+
+    def finish(self, rows: list[tuple]) -> tuple[list[dict], list[str]]:
+        """Adds the rows CARD_QUERY returned to the cached cards, in the order they were asked for"""
+        cards, missing_not_found = cards_from_rows(self.missing_ids, self.card_uuids, rows)
+        for card in cards:
+            card_dict = card.get_dict()
+            self.card_dicts[card.scryfall_id] = card_dict
+            card_cache.put(card.scryfall_id, card_dict)
+
+        card_dicts = [self.card_dicts[scryfall_id] for scryfall_id in self.scryfall_ids if scryfall_id in self.card_dicts]
+        return card_dicts, self.not_found + missing_not_found
+
+def get_card_dicts(scryfall_ids: list[str], cur: psycopg.Cursor | None = None) -> tuple[list[dict], list[str]]:
+    """
+    Same as get_cards, but returns Card.get_dict() for each card and serves
+    them from card_cache when it can. The returned dicts are shared, don't modify them.
+    Without cur the request's connection is only checked out if a card isn't cached
+    """
+    get_catalog_version()
+
+    lookup = CardDictsLookup(scryfall_ids)
+    rows = []
+    if lookup.needs_query:
+        if cur == None:
+            cur = get_database_connection().cursor()
+        res = cur.execute(CARD_QUERY, lookup.query_params)
+        rows = res.fetchall()
+
+    return lookup.finish(rows)
+
+# Maps token hash -> (user ID, ValidUntil) so scripted clients don't hit the
+# database on every call. Expiry is still checked on every call, the TTL only
+# bounds how long a token deleted by another worker keeps working here
+token_cache = TTLCache(getattr(config, 'TOKEN_CACHE_SIZE', 1000), getattr(config, 'TOKEN_CACHE_TTL', 60))
+
+def hash_token(token_bytes: bytes) -> bytes:
+    hasher = hashlib.new(HASH_FUNCTION)
+    hasher.update(token_bytes)
+    return hasher.digest()
+
+def get_user_id_from_token(cur: psycopg.Cursor, token: str) -> tuple[int, None] | tuple[None, dict]:
+    try:
+        hashed_token_bytes = hash_token(binascii.unhexlify(token))
+    except (binascii.Error, ValueError):
         error = {'successful': False, 'error': "Token is invalid"}
         return None, error
 
+    row = token_cache.get(hashed_token_bytes)
+    if row == None:
+        cur.execute('''SELECT Users.ID, APITokens.ValidUntil FROM Users
+                       INNER JOIN APITokens ON APITokens.UserID = Users.ID
+                       WHERE APITokens.TokenHash = %s''', (hashed_token_bytes, ))
+
+        row = cur.fetchone()
+        if row == None:
+            error = {'successful': False, 'error': "Token is invalid"}
+            return None, error
+
+        token_cache.put(hashed_token_bytes, row)
+
     user_id, valid_until = row
 
     # If valid_until is None then the token never expires
@@ -264,38 +634,125 @@ def get_user_id_from_token(cur: psycopg.Cursor, token: str) -> tuple[int, None]
 
     return user_id, None
 
-def api_collection_search(search_text: str, page: int, user_id):
+def like_pattern(search_text: str) -> str:
+    """Turns search_text into a LIKE pattern that matches it anywhere in a (lowercased) string"""
+    # Escape LIKE's special characters so they're matched literally
+    escaped = search_text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f'%{escaped}%'
+
+def api_collection_search(search_text: str, page: int, user_id, cur: psycopg.Cursor, after: str | None = None):
+    """
+    Returns a page of the user's collection whose names contain search_text.
+    If after is None the page is chosen by page number, otherwise it's the page
+    after the cursor in after ('' for the first page) and page is ignored
+    """
     cards = []
 
-    res = cur.execute('''SELECT colls.ID, cards.ID, cards.Name, finishes.Finish, colls.Condition, langs.Lang, colls.Signed, colls.Altered, colls.Notes, colls.Quantity FROM Collections colls
-                      INNER JOIN FinishCards finishCards ON colls.FinishCardID = finishCards.ID
-                      INNER JOIN Cards cards ON finishCards.CardID = cards.ID
-                      INNER JOIN Finishes finishes ON finishCards.FinishID = finishes.ID
-                      INNER JOIN Langs langs ON cards.langID = langs.ID
-                      WHERE colls.UserID = %s
-                      ORDER BY cards.Name, cards.ReleasedAt DESC
-                      ''', (user_id,))
+    if after == None:
+        # COUNT(*) OVER() is computed before LIMIT/OFFSET so every row
+        # carries the total number of matches
+        res = cur.execute('''SELECT colls.ID, cards.ID, finishes.Finish, colls.Condition, langs.Lang, colls.Signed, colls.Altered, colls.Notes, colls.Quantity, cards.Name, cards.ReleasedAt, COUNT(*) OVER() FROM Collections colls
+                          INNER JOIN FinishCards finishCards ON colls.FinishCardID = finishCards.ID
+                          INNER JOIN Cards cards ON finishCards.CardID = cards.ID
+                          INNER JOIN Finishes finishes ON finishCards.FinishID = finishes.ID
+                          INNER JOIN Langs langs ON cards.langID = langs.ID
+                          WHERE colls.UserID = %s AND LOWER(cards.Name) LIKE %s
+                          ORDER BY cards.Name, cards.ReleasedAt DESC, colls.ID
+                          LIMIT %s OFFSET %s
+                          ''', (user_id, like_pattern(search_text), PAGE_SIZE, page * PAGE_SIZE))
+    else:
+        keyset = 'TRUE'
+        params = ()
+        if after != '':
+            keyset = keyset_condition('cards.Name', 'cards.ReleasedAt', 'colls.ID')
+            params = keyset_params(after, int)
+
+        # We grab one extra row to find out if there's a next page
+        res = cur.execute(f'''SELECT colls.ID, cards.ID, finishes.Finish, colls.Condition, langs.Lang, colls.Signed, colls.Altered, colls.Notes, colls.Quantity, cards.Name, cards.ReleasedAt, NULL FROM Collections colls
+                          INNER JOIN FinishCards finishCards ON colls.FinishCardID = finishCards.ID
+                          INNER JOIN Cards cards ON finishCards.CardID = cards.ID
+                          INNER JOIN Finishes finishes ON finishCards.FinishID = finishes.ID
+                          INNER JOIN Langs langs ON cards.langID = langs.ID
+                          WHERE colls.UserID = %s AND LOWER(cards.Name) LIKE %s AND {keyset}
+                          ORDER BY cards.Name, cards.ReleasedAt DESC, colls.ID
+                          LIMIT %s
+                          ''', (user_id, like_pattern(search_text)) + params + (PAGE_SIZE + 1,))
     results = res.fetchall()
 
-    for collection_id, scryfall_id, name, finish, condition, language, signed, altered, notes, quantity in results:
-        if search_text.lower() in name.lower():
-            cards.append({'collection_id': collection_id, 'scryfall_id': str(scryfall_id), 'finish': finish, 'quantity': quantity,
-                          'condition': condition, 'language': language, 'signed': signed,
-                          'altered': altered, 'notes': notes})
+    next_cursor = None
+    if after != None and len(results) > PAGE_SIZE:
+        results = results[:PAGE_SIZE]
+        last_row = results[-1]
+        next_cursor = encode_page_cursor(last_row[9], last_row[10], last_row[0])
+
+    length = 0
+    for collection_id, scryfall_id, finish, condition, language, signed, altered, notes, quantity, name, released_at, length in results:
+        cards.append({'collection_id': collection_id, 'scryfall_id': str(scryfall_id), 'finish': finish, 'quantity': quantity,
+                      'condition': condition, 'language': language, 'signed': signed,
+                      'altered': altered, 'notes': notes})
+
+    if after != None:
+        return json.dumps({'successful': True, 'cards': cards, 'next': next_cursor})
+
+    # A page past the end has no rows to carry the count, so we have to ask for it
+    if len(results) == 0 and page > 0:
+        res = cur.execute('''SELECT COUNT(*) FROM Collections colls
+                          INNER JOIN FinishCards finishCards ON colls.FinishCardID = finishCards.ID
+                          INNER JOIN Cards cards ON finishCards.CardID = cards.ID
+                          WHERE colls.UserID = %s AND LOWER(cards.Name) LIKE %s
+                          ''', (user_id, like_pattern(search_text)))
+        length = res.fetchone()[0]
+
+    return json.dumps({'successful': True, 'cards': cards, 'length': length})
 
-    length = len(cards)
+# How long (in seconds) browsers can reuse catalog responses before checking if they changed
+CATALOG_CACHE_MAX_AGE = getattr(config, 'CATALOG_CACHE_MAX_AGE', 300)
+
+# Catalog responses only change when the catalog is imported, so the
+# catalog version works as their ETag (and its import time as Last-Modified)
+def add_catalog_cache_headers(response, catalog: tuple | None = None):
+    # catalog is the result of get_catalog_version(), looked up if it isn't passed in
+    if catalog == None:
+        catalog = get_catalog_version()
+    version, imported_at = catalog
+    response.set_etag(f'catalog-{version}', weak=True)
+    if imported_at != None:
+        response.last_modified = imported_at
+    response.cache_control.public = True
+    response.cache_control.max_age = CATALOG_CACHE_MAX_AGE
+
+def catalog_not_modified(environ: dict | None = None, catalog: tuple | None = None):
+    """
+    Returns a 304 response if the client already has the current version
+    of the catalog (going by If-None-Match/If-Modified-Since), otherwise None.
+    environ defaults to the current request's
+    """
+    if environ == None:
+        environ = request.environ
+    if catalog == None:
+        catalog = get_catalog_version()
+
+    version, imported_at = catalog
+    if is_resource_modified(environ, etag=f'catalog-{version}', last_modified=imported_at):
+        return None
 
-    start = PAGE_SIZE * page
-    end = start + PAGE_SIZE
-    cards = cards[start:end]
+    response = app.response_class(status=304)
+    add_catalog_cache_headers(response, catalog)
+    return response
 
-    return json.dumps({'successful': True, 'cards': cards, 'length': length})
+def catalog_response(body: str, catalog: tuple | None = None):
+    response = app.response_class(body)
+    add_catalog_cache_headers(response, catalog)
+    return response
+
+# Every language of a printing shares a PrintingID
+LANGUAGES_QUERY = '''SELECT A.ID, A.DefaultLang, Langs.Lang FROM Cards B
+                     INNER JOIN Cards A ON A.PrintingID = B.PrintingID
+                     INNER JOIN Langs ON A.LangID = Langs.ID
+                     WHERE B.ID = %s'''
 
 @app.route("/api/all_cards/languages")
 def api_all_cards_languages():
-    con = get_database_connection()
-    cur = con.cursor()
-
     args = request.args
     scryfall_id = args.get('scryfall_id')
 
@@ -303,16 +760,24 @@ def api_all_cards_languages():
         error = {'successful': False, 'error': 'Expected query param "scryfall_id"'}
         return json.dumps(error)
 
-    res = cur.execute('''SELECT A.ID, A.DefaultLang, Langs.Lang FROM Cards A
-                CROSS JOIN Cards B
-                INNER JOIN Langs ON A.LangID = Langs.ID
-                WHERE B.ID = %s AND A.CollectorNumber = B.CollectorNumber AND A.SetID = B.SetID''', (scryfall_id,))
+    not_modified = catalog_not_modified()
+    if not_modified != None:
+        return not_modified
+
+    con = get_database_connection()
+    cur = con.cursor()
+
+    res = cur.execute(LANGUAGES_QUERY, (scryfall_id,))
 
     rows = res.fetchall()
     if len(rows) == 0:
         error = {'successful': False, 'error': f"Couldn't find a card with scryfall_id \"{scryfall_id}\""}
         return json.dumps(error)
 
+    return catalog_response(json.dumps(language_dicts(rows)))
+
+def language_dicts(rows: list[tuple]) -> list[dict]:
+    """Turns the rows LANGUAGES_QUERY returned into the /api/all_cards/languages response"""
     languages = []
 
     for row in rows:
@@ -327,65 +792,145 @@ def api_all_cards_languages():
 
         languages.append(obj)
 
-    return json.dumps(languages)
+    return languages
 
 @app.route("/api/by_id")
 def api_by_id():
-    con = get_database_connection()
-    cur = con.cursor()
-
     args = request.args
     scryfall_id = args.get('scryfall_id')
 
     if scryfall_id == None:
         error = {'successful': False, 'error': 'Expected query param "scryfall_id"'}
         return json.dumps(error)
+
+    not_modified = catalog_not_modified()
+    if not_modified != None:
+        return not_modified
+
+    con = get_database_connection()
+    cur = con.cursor()
+
+    cards, not_found = get_card_dicts([scryfall_id], cur)
+    if len(not_found) != 0:
+        return json.dumps({'successful': False, 'error': f"Couldn't find card with ID \"{scryfall_id}\""})
+
+    return catalog_response(json.dumps(cards[0]))
+
+# Card images are fetched once and served from here instead of hot linking scryfall.
+# Setting IMAGE_SOURCE_DIR reads them out of a local directory instead (for tests and offline use)
+if getattr(config, 'IMAGE_SOURCE_DIR', None) != None:
+    image_fetcher = DirectoryFetcher(config.IMAGE_SOURCE_DIR)
+else:
+    image_fetcher = HTTPFetcher(timeout=getattr(config, 'IMAGE_FETCH_TIMEOUT', 10.0))
+
+image_cache = ImageCache(
+    getattr(config, 'IMAGE_CACHE_DIR', os.path.join(app.root_path, 'image_cache')),
+    image_fetcher,
+    thumbnail_width=getattr(config, 'THUMBNAIL_WIDTH', 250)
+)
+# Scryfall changes the image URL when it updates an image, so ours only change after a catalog import
+IMAGE_CACHE_MAX_AGE = getattr(config, 'IMAGE_CACHE_MAX_AGE', 7 * 24 * 60 * 60)
+
+@app.route("/images/<any(normal, thumbnail):size>/<scryfall_id>/<int:face>")
+def card_image(size, scryfall_id, face):
+    cards, not_found = get_card_dicts([scryfall_id])
+    if len(not_found) != 0 or cards[0]['image_uris'] == None or face >= len(cards[0]['image_uris']):
+        return abort(404)
+    image_uri = cards[0]['image_uris'][face]
+
+    # Fetching (and resizing) can take seconds, the connection (if the card
+    # or catalog version had to be looked up) goes back to the pool in the meantime
+    release_database_connection()
+
     try:
-        card = Card(scryfall_id)
-    except NotFoundException as e:
-        return json.dumps({'successful': False, 'error': str(e)})
+        if size == 'thumbnail':
+            image = image_cache.get_thumbnail(image_uri)
+        else:
+            image = image_cache.get(image_uri)
+    except ImageFetchException as e:
+        app.logger.warning(e)
+        return abort(502)
 
-    return json.dumps(card.get_dict())
+    # Answers If-None-Match with a 304
+    return send_file(image.path, mimetype=image.mimetype, etag=image.digest, max_age=IMAGE_CACHE_MAX_AGE)
 
 
-def api_all_cards_search(search_text: str, page: int, default: bool):
+def api_all_cards_search(search_text: str, page: int, default: bool, after: str | None = None):
+    """
+    Returns a page of cards whose names contain search_text.
+    If after is None the page is chosen by page number, otherwise it's the page
+    after the cursor in after ('' for the first page) and page is ignored
+    """
     con = get_database_connection()
     cur = con.cursor()
 
-    cards = []
-    search_string = f'%{search_text}%'
+    count_query, page_query = all_cards_search_queries(search_text, page, default, after)
 
-    if default:
-        res = cur.execute('''SELECT COUNT(*) FROM Cards
-                          WHERE LOWER(Name) LIKE %s AND DefaultLang = true''',
-                          (search_string,))
+    length = None
+    if count_query != None:
+        res = cur.execute(*count_query)
         length = res.fetchone()[0]
 
-        res = cur.execute('''SELECT ID FROM Cards
-                          WHERE LOWER(Name) LIKE %s AND DefaultLang = true
-                          ORDER BY Name, ReleasedAt DESC
-                          LIMIT %s OFFSET %s
-                          ''',
-                          (search_string, PAGE_SIZE, page * PAGE_SIZE))
-    else:
-        res = cur.execute('''SELECT COUNT(*) FROM Cards
-                          WHERE LOWER(Name) LIKE %s
-                          ''',
-                          (search_string,))
-        length = res.fetchone()[0]
+    res = cur.execute(*page_query)
+    return all_cards_search_body(res.fetchall(), after, length)
 
-        res = cur.execute('''SELECT ID FROM Cards
-                          WHERE LOWER(Name) LIKE %s
-                          ORDER BY Name, ReleasedAt DESC
-                          LIMIT %s OFFSET %s
-                          ''',
-                          (search_string, PAGE_SIZE, page * PAGE_SIZE))
+def all_cards_search_queries(search_text: str, page: int, default: bool, after: str | None) -> tuple[tuple | None, tuple]:
+    """
+    The (query, params) that count the matches (None when paging by cursor)
+    and the (query, params) that select the page for api_all_cards_search
+    """
+    # LOWER(Name) LIKE matches the expression the trigram indexes
+    # migrations.py creates are built on
+    search_string = like_pattern(search_text)
 
-    card_results = res.fetchall()
+    default_condition = 'TRUE'
+    if default:
+        default_condition = 'DefaultLang = true'
+
+    if after == None:
+        count_query = (f'''SELECT COUNT(*) FROM Cards
+                       WHERE LOWER(Name) LIKE %s AND {default_condition}''',
+                       (search_string,))
+
+        page_query = (f'''SELECT ID, Name, ReleasedAt FROM Cards
+                      WHERE LOWER(Name) LIKE %s AND {default_condition}
+                      ORDER BY Name, ReleasedAt DESC, ID
+                      LIMIT %s OFFSET %s
+                      ''',
+                      (search_string, PAGE_SIZE, page * PAGE_SIZE))
+        return count_query, page_query
+    else:
+        keyset = 'TRUE'
+        params = ()
+        if after != '':
+            keyset = keyset_condition('Name', 'ReleasedAt', 'ID')
+            params = keyset_params(after, uuid.UUID)
+
+        # We grab one extra row to find out if there's a next page
+        page_query = (f'''SELECT ID, Name, ReleasedAt FROM Cards
+                      WHERE LOWER(Name) LIKE %s AND {default_condition} AND {keyset}
+                      ORDER BY Name, ReleasedAt DESC, ID
+                      LIMIT %s
+                      ''',
+                      (search_string,) + params + (PAGE_SIZE + 1,))
+        return None, page_query
+
+def all_cards_search_body(card_results: list[tuple], after: str | None, length: int | None) -> str:
+    """Turns the rows the page query returned into the /api/all_cards response"""
+    cards = []
+
+    next_cursor = None
+    if after != None and len(card_results) > PAGE_SIZE:
+        card_results = card_results[:PAGE_SIZE]
+        id_, name, released_at = card_results[-1]
+        next_cursor = encode_page_cursor(name, released_at, str(id_))
 
     for card in card_results:
         cards.append({'scryfall_id': str(card[0])})
 
+    if after != None:
+        return json.dumps({'cards': cards, 'next': next_cursor})
+
     return json.dumps({'cards': cards, 'length': length})
 
 
@@ -416,105 +961,101 @@ def api_all_card_many():
         return json.dumps(error)
 
 
-    cards = []
-    for scryfall_id in scryfall_ids:
-        try:
-            card = Card(scryfall_id)
-        except NotFoundException as e:
-            return json.dumps({'successful': False, 'error': str(e)})
-
-        cards.append(card.get_dict())
+    cards, not_found = get_card_dicts(scryfall_ids, cur)
 
     return_obj = {
-        'data': cards
+        'data': cards,
+        'not_found': not_found
     }
 
     return json.dumps(return_obj)
 
 
-@app.route("/api/all_cards")
-def api_all_cards():
-    args = request.args
+def parse_all_cards_args(args) -> tuple[tuple, None] | tuple[None, dict]:
+    """
+    Reads the query parameters of /api/all_cards (shared with asgi.py).
+    Returns ((search_text, page, default, after), None) or (None, error)
+    """
     page = args.get('page')
-    query = args.get('query')
-    default = args.get('default')
-
     if page:
-        page = int(page)
+        try:
+            page = int(page)
+        except ValueError:
+            page = -1
+        if page < 0:
+            error = {'successful': False, 'error': f"Expected query param \"page\" to be a whole number, got \"{args.get('page')}\""}
+            return None, error
     else:
         page = 0
 
-    if default:
-        default = default == 'true'
-    else:
-        default = False
+    default = args.get('default') == 'true'
 
+    # Passing after (even empty) switches to cursor based paging
+    after = args.get('after')
+
+    search_text = ''
+    query = args.get('query')
     if query:
-        if query == 'search':
-            # TODO: Check this exists and is valid
-            search_text = args.get('text')
-            return api_all_cards_search(search_text, page, default)
-        else:
-            # Return an error
-            pass
-    else:
-        return api_all_cards_search('', page, default)
+        if query != 'search':
+            error = {'successful': False, 'error': f"Unknown query \"{query}\""}
+            return None, error
 
-def get_other_language_id(scryfall_id: str, lang: str) -> tuple[str, None] | tuple[None, dict]:
-    res = cur.execute('''SELECT SetID, CollectorNumber FROM Cards
-                      WHERE ID = %s''', (scryfall_id,))
+        search_text = args.get('text')
+        if search_text == None:
+            error = {'successful': False, 'error': 'Expected query param "text"'}
+            return None, error
 
+    return (search_text, page, default, after), None
 
-    set_id_collector_number = res.fetchone()
-    if set_id_collector_number == None:
-        error = {'successful': False, 'error': "Couldn't find card with ID \"{scryfall_id}\""}
-        return None, error
+@app.route("/api/all_cards")
+def api_all_cards():
+    params, error = parse_all_cards_args(request.args)
+    if error != None:
+        return json.dumps(error)
 
-    set_id, collector_number = set_id_collector_number
+    search_text, page, default, after = params
+    try:
+        return api_all_cards_search(search_text, page, default, after)
+    except InvalidCursorException as e:
+        return json.dumps({'successful': False, 'error': str(e)})
 
-    res = cur.execute('''SELECT ID FROM Langs
-                      WHERE Lang = %s
-                      ''', (lang,))
+# The LEFT JOIN means we get a row (with a NULL ID) when the card
+# exists but not in that language, and no row when the card doesn't exist
+OTHER_LANGUAGE_QUERY = '''SELECT Other.ID FROM Cards
+                          LEFT JOIN Cards Other ON Other.PrintingID = Cards.PrintingID AND Other.LangID = %s
+                          WHERE Cards.ID = %s'''
 
-    lang_id = res.fetchone()
+def get_other_language_id(scryfall_id: str, lang: str, cur: psycopg.Cursor) -> tuple[str, None] | tuple[None, dict]:
+    lang_id = get_lookup_tables(cur).lang_ids.get(lang)
     if lang_id == None:
         error = {'successful': False, 'error': f"Couldn't find lang \"{lang}\""}
         return None, error
 
-    lang_id = lang_id[0]
-
-    res = cur.execute('''SELECT ID FROM Cards
-                      WHERE
-                        SetID = %s AND
-                        CollectorNumber = %s AND
-                        LangID = %s
-                      ''', (set_id, collector_number, lang_id))
+    res = cur.execute(OTHER_LANGUAGE_QUERY, (lang_id, scryfall_id))
 
-    scryfall_id = res.fetchone()
+    row = res.fetchone()
+    if row == None:
+        error = {'successful': False, 'error': f"Couldn't find card with ID \"{scryfall_id}\""}
+        return None, error
 
-    if scryfall_id == None:
+    if row[0] == None:
         # TODO: Improve this error message
         error = {'successful': False, 'error': f"Couldn't find card that card in that language"}
         return None, error
 
-    scryfall_id = str(scryfall_id[0])
+    scryfall_id = str(row[0])
 
     return scryfall_id, None
 
 
-def get_finish_card_id(finish: str, scryfall_id: str) -> tuple[None, int] | tuple[dict, None]:
+def get_finish_card_id(finish: str, scryfall_id: str, cur: psycopg.Cursor) -> tuple[None, int] | tuple[dict, None]:
     error = None
-    res = cur.execute('''SELECT ID FROM Finishes
-                         WHERE Finish = %s
-                      ''', (finish,))
-    finish_id = res.fetchone()
+    finish_id = get_lookup_tables(cur).finish_ids.get(finish)
 
     if finish_id == None:
         error = {'successful': False, 'error': f"No such finish {finish}"}
         return (error, None)
 
-    finish_id = finish_id[0]
-
     res = cur.execute('''SELECT ID FROM FinishCards
                       WHERE CardID = %s AND FinishID = %s
                       ''', (scryfall_id, finish_id))
@@ -528,6 +1069,261 @@ def get_finish_card_id(finish: str, scryfall_id: str) -> tuple[None, int] | tupl
 
     return error, finish_card_id
 
+def get_finish_card_ids(cards: list[tuple[str, str]], cur: psycopg.Cursor) -> dict:
+    """
+    Bulk version of get_finish_card_id, cards is a list of (scryfall_id, finish).
+    Every scryfall_id must be a valid UUID and every finish must exist.
+    Returns a dict mapping each (scryfall_id, finish) to (error, None) or
+    (None, (finish_card_id, card)) where card is the card's name, collector number and set
+    """
+    finish_ids = get_lookup_tables(cur).finish_ids
+    wanted = set(cards)
+    if len(wanted) == 0:
+        return {}
+
+    res = cur.execute('''SELECT wanted.CardID, wanted.FinishID, FinishCards.ID, Cards.Name, Cards.CollectorNumber, Sets.Code
+                      FROM unnest(%s::uuid[], %s::integer[]) AS wanted(CardID, FinishID)
+                      LEFT JOIN Cards ON Cards.ID = wanted.CardID
+                      LEFT JOIN Sets ON Sets.ID = Cards.SetID
+                      LEFT JOIN FinishCards ON FinishCards.CardID = wanted.CardID AND FinishCards.FinishID = wanted.FinishID
+                      ''', ([uuid.UUID(scryfall_id) for scryfall_id, _ in wanted], [finish_ids[finish] for _, finish in wanted]))
+    rows = {(card_id, finish_id): row for card_id, finish_id, *row in res.fetchall()}
+
+    finish_card_ids = {}
+    for scryfall_id, finish in wanted:
+        finish_card_id, name, collector_number, set_code = rows[(uuid.UUID(scryfall_id), finish_ids[finish])]
+        if name == None:
+            error = {'successful': False, 'error': f'Couldn\'t find a card with that id "{scryfall_id}"'}
+            finish_card_ids[(scryfall_id, finish)] = (error, None)
+        elif finish_card_id == None:
+            error = {'successful': False, 'error': f"That card doesn't come in the finish \"{finish}\""}
+            finish_card_ids[(scryfall_id, finish)] = (error, None)
+        else:
+            card = {
+                'name': name,
+                'collector_number': collector_number,
+                'set_abbr': set_code
+            }
+            finish_card_ids[(scryfall_id, finish)] = (None, (finish_card_id, card))
+
+    return finish_card_ids
+
+# The keys (and their types) needed to add a card to a collection
+COLLECTION_CARD_PARAM_TYPES = {
+    'scryfall_id': str,
+    'quantity': int,
+    'finish': str,
+    'condition': str,
+    'signed': bool,
+    'altered': bool,
+    'notes': str
+}
+
+def validate_collection_card(card_json: dict, body_name: str, cur: psycopg.Cursor) -> dict | None:
+    """Checks card_json has everything needed to add it to a collection. Returns an error or None"""
+    for param_name, param_type in COLLECTION_CARD_PARAM_TYPES.items():
+        param_value = card_json.get(param_name)
+        if param_value == None:
+            error = {'successful': False, 'error': f'Expected key "{param_name}" not found in {body_name}.'}
+            return error
+
+        if type(param_value) != param_type:
+            error = {'successful': False, 'error': f'Expected key "{param_name}" to be a of type {param_type}, got {str(type(param_value).__name__)}'}
+            return error
+
+    # TODO: Check for unexpected keys
+
+    if card_json['condition'] not in get_lookup_tables(cur).conditions:
+        error = {'successful': False, 'error': f'No such condition "{card_json["condition"]}"'}
+        return error
+
+    return None
+
+# The keys a PATCH replacement can have, all of them are optional.
+# The card is picked by language instead of scryfall_id
+REPLACEMENT_CARD_PARAM_TYPES = {param_name: param_type for param_name, param_type in COLLECTION_CARD_PARAM_TYPES.items() if param_name != 'scryfall_id'} | {'language': str}
+
+def validate_replacement_card(replacement_card, cur: psycopg.Cursor) -> dict | None:
+    """Checks a PATCH replacement before anything is changed. Returns an error or None"""
+    if type(replacement_card) != dict:
+        return {'successful': False, 'error': "Expected key 'replacement' to be of type dict"}
+
+    for param_name, param_value in replacement_card.items():
+        param_type = REPLACEMENT_CARD_PARAM_TYPES.get(param_name)
+        if param_type == None:
+            return {'successful': False, 'error': f'Unexpected key "{param_name}" in replacement'}
+
+        if type(param_value) != param_type:
+            return {'successful': False, 'error': f'Expected key "{param_name}" to be a of type {param_type}, got {str(type(param_value).__name__)}'}
+
+    lookup_tables = get_lookup_tables(cur)
+    if 'quantity' in replacement_card and replacement_card['quantity'] <= 0:
+        return {'successful': False, 'error': 'Expected "quantity" to be positive'}
+
+    if 'condition' in replacement_card and replacement_card['condition'] not in lookup_tables.conditions:
+        return {'successful': False, 'error': f'No such condition "{replacement_card["condition"]}"'}
+
+    if 'finish' in replacement_card and replacement_card['finish'] not in lookup_tables.finish_ids:
+        return {'successful': False, 'error': f"No such finish {replacement_card['finish']}"}
+
+    if 'language' in replacement_card and replacement_card['language'] not in lookup_tables.lang_ids:
+        return {'successful': False, 'error': f"Couldn't find lang \"{replacement_card['language']}\""}
+
+    return None
+
+# Adds quantity (which can be negative) copies of a card to a collection in one statement.
+# existing locks the current row (if there is one) so concurrent +/- clicks queue up.
+# If the quantity would drop to 0 or below the row is deleted instead of updated,
+# otherwise the row is upserted. The two never both happen, which matters because a
+# statement can't modify the same row twice
+ADD_TO_COLLECTION_QUERY = '''
+                          WITH existing AS (
+                              SELECT ID, Quantity FROM Collections
+                              WHERE UserID = %(user_id)s AND
+                                    FinishCardID = %(finish_card_id)s AND
+                                    Condition = %(condition)s::condition AND
+                                    Signed = %(signed)s AND
+                                    Altered = %(altered)s AND
+                                    Notes = %(notes)s
+                              FOR UPDATE
+                          ), deleted AS (
+                              DELETE FROM Collections
+                              WHERE ID IN (SELECT ID FROM existing WHERE Quantity + %(quantity)s <= 0)
+                              RETURNING Quantity
+                          ), upserted AS (
+                              INSERT INTO Collections(UserID, FinishCardID, Condition, Signed, Altered, Notes, Quantity)
+                              SELECT %(user_id)s, %(finish_card_id)s, %(condition)s::condition, %(signed)s, %(altered)s, %(notes)s, %(quantity)s
+                              WHERE NOT EXISTS (SELECT 1 FROM existing WHERE Quantity + %(quantity)s <= 0) AND
+                                    (%(quantity)s > 0 OR EXISTS (SELECT 1 FROM existing))
+                              ON CONFLICT (UserID, FinishCardID, Condition, Signed, Altered, Notes)
+                              DO UPDATE SET Quantity = Collections.Quantity + EXCLUDED.Quantity
+                              RETURNING Quantity
+                          )
+                          SELECT COALESCE((SELECT Quantity FROM deleted), (SELECT Quantity - %(quantity)s FROM upserted), 0),
+                                 COALESCE((SELECT Quantity FROM upserted), 0)
+                          '''
+
+def add_to_collection(cur: psycopg.Cursor, user_id: int, finish_card_id: int, condition: str, signed: bool, altered: bool, notes: str, quantity: int) -> tuple[int, int]:
+    """
+    Adds quantity copies (or removes them if it's negative) of a card to a collection
+    and updates the collection's stats to match. Removing everything deletes the row.
+    Returns the quantity before and after
+    """
+    res = cur.execute(ADD_TO_COLLECTION_QUERY, {
+        'user_id': user_id,
+        'finish_card_id': finish_card_id,
+        'condition': condition,
+        'signed': signed,
+        'altered': altered,
+        'notes': notes,
+        'quantity': quantity
+    })
+
+    original_quantity, updated_quantity = res.fetchone()
+    update_collection_stats(cur, user_id, [(finish_card_id, updated_quantity - original_quantity)])
+    return original_quantity, updated_quantity
+
+def replace_collection_card(cur: psycopg.Cursor, user_id: int, target_card_id: int, replacement_card: dict) -> dict:
+    """
+    Replaces the collection entry target_card_id with replacement_card, any key
+    missing from replacement_card keeps its current value.
+    Returns the response for the PATCH (or an error). Doesn't commit
+    """
+    res = cur.execute('''SELECT
+                            Finishes.Finish,
+                            FinishCards.CardID,
+                            Colls.Quantity,
+                            Colls.Condition,
+                            Colls.Signed,
+                            Colls.Altered,
+                            Colls.Notes,
+                            Langs.Lang,
+                            Cards.Name,
+                            Cards.NormalImageURI FROM Collections as Colls
+                      INNER JOIN FinishCards ON Colls.FinishCardID = FinishCards.ID
+                      INNER JOIN Finishes ON FinishCards.FinishID = Finishes.ID
+                      INNER JOIN Cards ON FinishCards.CardID = Cards.ID
+                      INNER JOIN Langs ON Cards.LangID = Langs.ID
+                      WHERE
+                        Colls.ID = %s AND
+                        Colls.UserID = %s
+                      ''', (target_card_id, user_id))
+    defaults = res.fetchone()
+    if defaults == None:
+        error = {'successful': False, 'error': f"Couldn't find target card in database"}
+        return error
+
+    default_finish, default_scryfall_id, default_quantity, default_condition, default_signed, default_altered, default_notes, default_lang, card_name, normal_image_uri = defaults
+
+    replacement_lang = replacement_card.get('language', default_lang)
+    # Changing languages means we need to change scryfall_id as well
+    scryfall_id, error = get_other_language_id(default_scryfall_id, replacement_lang, cur)
+    if scryfall_id == None:
+        return error
+
+    replacement_finish = replacement_card.get('finish', default_finish)
+    error, replacement_finish_card_id = get_finish_card_id(replacement_finish, scryfall_id, cur)
+    if error != None:
+        return error
+
+    replacement_quantity = replacement_card.get('quantity', default_quantity)
+    replacement_condition = replacement_card.get('condition', default_condition)
+    if replacement_condition not in get_lookup_tables(cur).conditions:
+        error = {'successful': False, 'error': f'No such condition "{replacement_condition}"'}
+        return error
+
+    replacement_signed = replacement_card.get('signed', default_signed)
+    replacement_altered = replacement_card.get('altered', default_altered)
+    replacement_notes = replacement_card.get('notes', default_notes)
+
+    try:
+        # The savepoint keeps the transaction usable if this fails,
+        # so callers can keep going (see api_collection_batch)
+        with cur.connection.transaction():
+            # Returns what the row was before the update (Old is locked so it can't change under us)
+            res = cur.execute(f'''UPDATE Collections
+                            SET
+                              FinishCardID = %s,
+                              Quantity = %s,
+                              Condition = %s,
+                              Signed = %s,
+                              Altered = %s,
+                              Notes = %s
+                            FROM (SELECT ID, FinishCardID, Quantity FROM Collections
+                                  WHERE
+                                    ID = %s AND
+                                    UserID = %s
+                                  FOR UPDATE) AS Old
+                            WHERE
+                              Collections.ID = Old.ID
+                            RETURNING Old.FinishCardID, Old.Quantity
+                            ''', (replacement_finish_card_id, replacement_quantity, replacement_condition, replacement_signed, replacement_altered, replacement_notes) + (target_card_id, user_id))
+
+            row = res.fetchone()
+            if row != None:
+                original_finish_card_id, original_quantity = row
+                update_collection_stats(cur, user_id, [(original_finish_card_id, -original_quantity), (replacement_finish_card_id, replacement_quantity)])
+    except psycopg.errors.UniqueViolation:
+        # TODO: This message is really long, but doesn't stay up for very long
+        # consider extending how long messages stay up (or make it configurable or based on length)
+        error = {'successful': False, 'error': "Updating that card in that way would cause it to be identical to another card in your collection, because it's unclear what to do in that case we err on the side of caution and do nothing. To accomplish this try removing all copies of the original card from your collection and then adding any number you need to the existing entry."}
+        return error
+
+    new_card = {
+        'scryfall_id': scryfall_id,
+        'finish': replacement_finish,
+        'quantity': replacement_quantity,
+        'condition': replacement_condition,
+        'signed': replacement_signed,
+        'altered': replacement_altered,
+        'notes': replacement_notes,
+        'name': card_name,
+        'language': replacement_lang,
+        'image_src': normal_image_uri
+    }
+    return_obj = {'successful': True, 'replaced_card_id': target_card_id, 'new_card': new_card}
+    return return_obj
+
 @app.route("/api/collection/by_id", methods = ['GET'])
 def api_collection_by_id():
     con = get_database_connection()
@@ -623,25 +1419,28 @@ def api_collection():
         else:
             page = 0
 
-        if query:
-            if query == 'search':
-                # TODO: Check this exists and is valid
-                search_text = args.get('text')
-                return api_collection_search(search_text, page, user_id)
+        # Passing after (even empty) switches to cursor based paging
+        after = args.get('after')
+
+        try:
+            if query:
+                if query == 'search':
+                    # TODO: Check this exists and is valid
+                    search_text = args.get('text')
+                    return api_collection_search(search_text, page, user_id, cur, after)
+                else:
+                    error = {'successful': False, 'error': f'Unsupported value for query parameter "query". Expected "search". Got {query}'}
+                    return json.dumps(error)
             else:
-                error = {'successful': False, 'error': f'Unsupported value for query parameter "query". Expected "search". Got {query}'}
-                return json.dumps(error)
-        else:
-            return api_collection_search('', page, user_id)
+                return api_collection_search('', page, user_id, cur, after)
+        except InvalidCursorException as e:
+            return json.dumps({'successful': False, 'error': str(e)})
 
     # This is where we add cards to the database
     # We need to do as much error checking as possible here
     # to ensure we don't accidently mess up the database
     # or say we're adding a card when in reality we aren't
     elif request.method == 'POST':
-        con = get_database_connection()
-        cur = con.cursor()
-
         authed_user_id, error = get_user_id(cur)
         if error:
             return json.dumps(error)
@@ -670,27 +1469,9 @@ def api_collection():
                 error = {'successful': False, 'error': "You are not authorized to access this collection."}
                 return json.dumps(error)
 
-            param_type_map = {
-                'scryfall_id': str,
-                'quantity': int,
-                'finish': str,
-                'condition': str,
-                'signed': bool,
-                'altered': bool,
-                'notes': str
-            }
-
-            for param_name, param_type in param_type_map.items():
-                param_value = request_json.get(param_name)
-                if param_value == None:
-                    error = {'successful': False, 'error': f'Expected key "{param_name}" not found in POST body.'}
-                    return json.dumps(error)
-
-                if type(param_value) != param_type:
-                    error = {'successful': False, 'error': f'Expected key "{param_name}" to be a of type {param_type}, got {str(type(param_value).__name__)}'}
-                    return json.dumps(error)
-
-            # TODO: Check for unexpected keys
+            error = validate_collection_card(request_json, 'POST body', cur)
+            if error != None:
+                return json.dumps(error)
 
             res = cur.execute("""SELECT Cards.Name, Cards.CollectorNumber, Sets.Code FROM Cards
                               INNER JOIN Sets ON Cards.SetID = Sets.ID
@@ -708,54 +1489,11 @@ def api_collection():
                     }
 
 
-            error, finish_card_id = get_finish_card_id(finish, scryfall_id)
+            error, finish_card_id = get_finish_card_id(finish, scryfall_id, cur)
             if error != None:
                 return json.dumps(error)
 
-            res = cur.execute('''SELECT Quantity FROM Collections
-                              WHERE UserID = %s AND
-                              FinishCardID = %s AND
-                              Condition = %s AND
-                              Signed = %s AND
-                              Altered = %s AND
-                              Notes = %s
-                              ''', (user_id, finish_card_id, condition, signed, altered, notes))
-            original_quantity = res.fetchone()
-            card_in_collection = original_quantity != None
-
-            if card_in_collection:
-                original_quantity = original_quantity[0]
-                res = cur.execute('''UPDATE collections SET Quantity = quantity + %s
-                            WHERE UserID = %s AND
-                            FinishCardID = %s AND
-                            Condition = %s AND
-                            Signed = %s AND
-                            Altered = %s AND
-                            Notes = %s
-                            RETURNING Quantity
-                            ''', (quantity, user_id, finish_card_id, condition, signed, altered, notes))
-                updated_quantity = res.fetchone()[0]
-            else:
-                original_quantity = 0
-                res = cur.execute('''INSERT INTO Collections(UserID, FinishCardID, Condition, Signed, Altered, Notes, Quantity)
-                            VALUES(%s, %s, %s, %s, %s, %s, %s)
-                            RETURNING Quantity
-                            ''', (user_id, finish_card_id, condition, signed, altered, notes, quantity))
-                updated_quantity = res.fetchone()[0]
-
-            # If we get a request to have 0 or negative updated_quantity we delete the row
-            # This can happen if the user clicks the - button
-            # while having 0 in the collection
-            if updated_quantity <= 0:
-                cur.execute('''DELETE FROM collections
-                        WHERE UserID = %s AND
-                        FinishCardID = %s AND
-                        Condition = %s AND
-                        Signed = %s AND
-                        Altered = %s AND
-                        Notes = %s
-                        ''', (user_id, finish_card_id, condition, signed, altered, notes))
-                updated_quantity = 0
+            original_quantity, updated_quantity = add_to_collection(cur, user_id, finish_card_id, condition, signed, altered, notes, quantity)
 
             delta = updated_quantity - original_quantity
 
@@ -766,10 +1504,6 @@ def api_collection():
             error = {'successful': False, 'error': f"Expected Content-Type: application/json, found {content_type}"}
             return json.dumps(error)
     elif request.method == "PATCH":
-        con = get_database_connection()
-        cur = con.cursor()
-
-
         authed_user_id, error = get_user_id(cur)
         if error != None:
             return json.dumps(error)
@@ -799,96 +1533,451 @@ def api_collection():
             error = {'successful': False, 'error': f"Didn't find expected key 'replacement' in PATCH body"}
             return json.dumps(error)
 
-        # TODO: Type check target and replacement
-
-        res = cur.execute('''SELECT
-                                Colls.FinishCardID,
-                                FinishCards.CardID,
-                                Colls.Quantity,
-                                Colls.Condition,
-                                Colls.Signed,
-                                Colls.Altered,
-                                Colls.Notes,
-                                Langs.Lang,
-                                Cards.Name,
-                                Cards.NormalImageURI FROM Collections as Colls
-                          INNER JOIN FinishCards ON Colls.FinishCardID = FinishCards.ID
-                          INNER JOIN Cards ON FinishCards.CardID = Cards.ID
-                          INNER JOIN Langs ON Cards.LangID = Langs.ID
-                          WHERE
-                            Colls.ID = %s AND
-                            Colls.UserID = %s
-                          ''', (target_card_id, user_id))
-        defaults = res.fetchone()
-        if defaults == None:
-            error = {'successful': False, 'error': f"Couldn't find target card in database"}
+        if type(target_card_id) != int:
+            error = {'successful': False, 'error': "Expected key 'target' to be the collection_id of the card to replace"}
             return json.dumps(error)
 
-        default_finish_card_id, default_scryfall_id, default_quantity, default_condition, default_signed, default_altered, default_notes, default_lang, card_name, normal_image_uri = defaults
-
-        replacement_lang = replacement_card.get('language', default_lang)
-        # Changing languages means we need to change scryfall_id as well
-        scryfall_id, error = get_other_language_id(default_scryfall_id, replacement_lang)
-        if scryfall_id == None:
+        error = validate_replacement_card(replacement_card, cur)
+        if error != None:
             return json.dumps(error)
 
-        print(default_lang, default_scryfall_id, replacement_lang, scryfall_id)
+        return_obj = replace_collection_card(cur, user_id, target_card_id, replacement_card)
+        if return_obj['successful']:
+            con.commit()
+
+        return json.dumps(return_obj)
+
+# Most operations one call to /api/collection/batch can make
+COLLECTION_BATCH_MAX_SIZE = getattr(config, 'COLLECTION_BATCH_MAX_SIZE', 1000)
+
+def validate_batch_operation(operation, cur: psycopg.Cursor) -> dict | None:
+    """Checks one operation for /api/collection/batch. Returns an error or None"""
+    if type(operation) != dict:
+        return {'successful': False, 'error': f"Expected operation to be of type dict, got {str(type(operation).__name__)}"}
 
-        replacement_finish = replacement_card.get('finish', default_finish_card_id)
-        error, replacement_finish_card_id = get_finish_card_id(replacement_finish, scryfall_id)
+    op = operation.get('op')
+    if op == 'add' or op == 'remove':
+        error = validate_collection_card(operation, 'operation', cur)
         if error != None:
-            return json.dumps(error)
+            return error
 
-        replacement_quantity = replacement_card.get('quantity', default_quantity)
-        replacement_condition = replacement_card.get('condition', default_condition)
-        replacement_signed = replacement_card.get('signed', default_signed)
-        replacement_altered = replacement_card.get('altered', default_altered)
-        replacement_notes = replacement_card.get('notes', default_notes)
+        if op == 'remove' and operation['quantity'] <= 0:
+            return {'successful': False, 'error': 'Expected "quantity" to be positive for a remove'}
 
         try:
-            res = cur.execute(f'''UPDATE Collections
-                        SET
-                          FinishCardID = %s,
-                          Quantity = %s,
-                          Condition = %s,
-                          Signed = %s,
-                          Altered = %s,
-                          Notes = %s
-                        WHERE
-                          ID = %s AND
-                          UserID = %s
-                        ''', (replacement_finish_card_id, replacement_quantity, replacement_condition, replacement_signed, replacement_altered, replacement_notes) + (target_card_id, user_id))
-        except psycopg.errors.UniqueViolation:
-            # TODO: This message is really long, but doesn't stay up for very long
-            # consider extending how long messages stay up (or make it configurable or based on length)
-            error = {'successful': False, 'error': "Updating that card in that way would cause it to be identical to another card in your collection, because it's unclear what to do in that case we err on the side of caution and do nothing. To accomplish this try removing all copies of the original card from your collection and then adding any number you need to the existing entry."}
-            return json.dumps(error)
+            uuid.UUID(operation['scryfall_id'])
+        except ValueError:
+            return {'successful': False, 'error': f'Couldn\'t find a card with that id "{operation["scryfall_id"]}"'}
+
+        if operation['finish'] not in get_lookup_tables(cur).finish_ids:
+            return {'successful': False, 'error': f"No such finish {operation['finish']}"}
+    elif op == 'patch':
+        if type(operation.get('target')) != int:
+            return {'successful': False, 'error': "Expected key 'target' to be the collection_id of the card to replace"}
+        error = validate_replacement_card(operation.get('replacement'), cur)
+        if error != None:
+            return error
+    else:
+        return {'successful': False, 'error': f'Unsupported value for "op". Expected "add", "remove" or "patch". Got {op}'}
 
-        con.commit()
-        new_card = {
-            'scryfall_id': scryfall_id,
-            'finish': replacement_finish,
-            'quantity': replacement_quantity,
-            'condition': replacement_condition,
-            'signed': replacement_signed,
-            'altered': replacement_altered,
-            'notes': replacement_notes,
-            'name': card_name,
-            'language': replacement_lang,
-            'image_src': normal_image_uri
-        }
-        return_obj = {'successful': True, 'replaced_card_id': target_card_id, 'new_card': new_card}
-        return json.dumps(return_obj)
+    return None
+
+# Adds, removes and replaces many cards at once. All of the operations are
+# checked before any are made and they're made in one transaction, so either
+# every operation happens or none of them do
+@app.route("/api/collection/batch", methods = ['POST'])
+def api_collection_batch():
+    con = get_database_connection()
+    cur = con.cursor()
+
+    authed_user_id, error = get_user_id(cur)
+    if error:
+        return json.dumps(error)
+
+    content_type = request.headers.get('Content-Type')
+    if (content_type != 'application/json'):
+        error = {'successful': False, 'error': f"Expected Content-Type: application/json, found {content_type}"}
+        return json.dumps(error)
+
+    request_json = request.json
+    if request_json == None or request_json == "":
+        error = {'successful': False, 'error': f"Expected content, got empty POST body"}
+        return json.dumps(error)
+
+    username = request_json.get('username')
+    if username == None:
+        error = {'successful': False, 'error': "Didn't find expected key \"username\""}
+        return json.dumps(error)
+
+    try:
+        user_id = get_user_id_by_username(username, cur)
+    except NotFoundException as e:
+        return json.dumps({'successful': False, 'error': str(e)})
+
+    if authed_user_id != user_id:
+        error = {'successful': False, 'error': "You are not authorized to access this collection."}
+        return json.dumps(error)
+
+    operations = request_json.get('operations')
+    if type(operations) != list:
+        error = {'successful': False, 'error': f"Expected key \"operations\" to be of type list, got {str(type(operations).__name__)}"}
+        return json.dumps(error)
+
+    if len(operations) > COLLECTION_BATCH_MAX_SIZE:
+        error = {'successful': False, 'error': f"Too many operations, at most {COLLECTION_BATCH_MAX_SIZE} are allowed at once"}
+        return json.dumps(error)
+
+    not_applied = {'successful': False, 'error': "Not applied because another operation failed"}
+
+    results = [validate_batch_operation(operation, cur) for operation in operations]
+    if any(result != None for result in results):
+        results = [result or not_applied for result in results]
+        return json.dumps({'successful': False, 'error': "Some operations were invalid, nothing was applied", 'results': results})
+
+    finish_card_ids = get_finish_card_ids([(operation['scryfall_id'], operation['finish']) for operation in operations if operation['op'] != 'patch'], cur)
+
+    results = []
+    for operation in operations:
+        if operation['op'] == 'patch':
+            results.append(replace_collection_card(cur, user_id, operation['target'], operation['replacement']))
+            continue
+
+        error, finish_card = finish_card_ids[(operation['scryfall_id'], operation['finish'])]
+        if error != None:
+            results.append(error)
+            continue
+
+        finish_card_id, card = finish_card
+        quantity = operation['quantity']
+        if operation['op'] == 'remove':
+            quantity = -quantity
+
+        original_quantity, updated_quantity = add_to_collection(cur, user_id, finish_card_id, operation['condition'], operation['signed'], operation['altered'], operation['notes'], quantity)
+        results.append({'successful': True, 'card': card, 'delta': updated_quantity - original_quantity, 'new_total': updated_quantity})
+
+    if not all(result['successful'] for result in results):
+        con.rollback()
+        results = [result if not result['successful'] else not_applied for result in results]
+        return json.dumps({'successful': False, 'error': "Some operations failed, nothing was applied", 'results': results})
+
+    con.commit()
+    return json.dumps({'successful': True, 'results': results})
+
+@app.route("/api/collection/stats", methods = ['GET'])
+def api_collection_stats():
+    """Totals for a collection by set, color, rarity and type (see collection_stats.py)"""
+    con = get_database_connection()
+    cur = con.cursor()
+
+    authed_user_id, error = get_user_id(cur)
+    if error:
+        return json.dumps(error)
+
+    username = request.args.get('username')
+    if username == None:
+        error = {'successful': False, 'error': "Didn't find expected query parameter \"username\""}
+        return json.dumps(error)
+
+    try:
+        user_id = get_user_id_by_username(username, cur)
+    except NotFoundException as e:
+        return json.dumps({'successful': False, 'error': str(e)})
+
+    if authed_user_id != user_id:
+        error = {'successful': False, 'error': "You are not authorized to access this collection."}
+        return json.dumps(error)
+
+    return_obj = {'successful': True, 'stats': get_collection_stats(cur, user_id)}
+    return json.dumps(return_obj)
+
+# Prices are stored in cents, ROLLUP adds a row with a NULL Code for the whole collection
+COLLECTION_VALUE_QUERY = '''
+                         SELECT Sets.Code, SUM(Colls.Quantity * Prices.USD), SUM(Colls.Quantity * Prices.EUR), SUM(Colls.Quantity * Prices.Tix)
+                         FROM Collections AS Colls
+                         INNER JOIN Prices ON Prices.FinishCardID = Colls.FinishCardID
+                         INNER JOIN Sets ON Sets.ID = Prices.SetID
+                         WHERE Colls.UserID = %s
+                         GROUP BY ROLLUP (Sets.Code)
+                         '''
+
+def prices_from_cents(usd: int | None, eur: int | None, tix: int | None) -> dict:
+    return {
+        'usd': usd / 100 if usd != None else None,
+        'eur': eur / 100 if eur != None else None,
+        'tix': tix / 100 if tix != None else None
+    }
+
+@app.route("/api/collection/value", methods = ['GET'])
+def api_collection_value():
+    """The value of a collection in total and by set. Cards without a price aren't counted"""
+    con = get_database_connection()
+    cur = con.cursor()
+
+    authed_user_id, error = get_user_id(cur)
+    if error:
+        return json.dumps(error)
+
+    username = request.args.get('username')
+    if username == None:
+        error = {'successful': False, 'error': "Didn't find expected query parameter \"username\""}
+        return json.dumps(error)
+
+    try:
+        user_id = get_user_id_by_username(username, cur)
+    except NotFoundException as e:
+        return json.dumps({'successful': False, 'error': str(e)})
+
+    if authed_user_id != user_id:
+        error = {'successful': False, 'error': "You are not authorized to access this collection."}
+        return json.dumps(error)
+
+    res = cur.execute(COLLECTION_VALUE_QUERY, (user_id,))
+
+    total = prices_from_cents(None, None, None)
+    sets = {}
+    for set_code, usd, eur, tix in res.fetchall():
+        if set_code == None:
+            total = prices_from_cents(usd, eur, tix)
+        else:
+            sets[set_code] = prices_from_cents(usd, eur, tix)
+
+    return_obj = {'successful': True, 'total': total, 'sets': sets}
+    return json.dumps(return_obj)
+
+DECKLIST_MAX_LINES = getattr(config, 'DECKLIST_MAX_LINES', 500)
+
+# Matches the usual decklist formats, everything but the name is optional:
+#   4 Lightning Bolt
+#   4x Lightning Bolt
+#   1 Sol Ring (C21) 263
+#   1 Sol Ring (C21) 263 *F*
+DECKLIST_LINE_PATTERN = re.compile(r'^(?:(\d+)x?\s+)?(.+?)(?:\s+\(([^()\s]+)\)(?:\s+([^\s*]+))?)?(?:\s+\*[A-Z]+\*)?$')
+# Lines that split a decklist into sections (ex. an Arena export), rather than being cards
+DECKLIST_SECTIONS = {'deck', 'mainboard', 'main', 'sideboard', 'commander', 'companion', 'maybeboard', 'maybe'}
+
+def parse_decklist(decklist: str) -> list[dict]:
+    """Returns a dict for every card line in decklist. Blank lines, comments and section headings are skipped"""
+    lines = []
+    for line in decklist.splitlines():
+        line = line.strip()
+        if line == '' or line.startswith('//') or line.startswith('#'):
+            continue
+        if line.rstrip(':').lower() in DECKLIST_SECTIONS:
+            continue
+
+        # Always matches since the name can be anything
+        quantity, name, set_code, collector_number = DECKLIST_LINE_PATTERN.match(line).groups()
+        lines.append({
+            'line': line,
+            'name': name,
+            'set': set_code.lower() if set_code != None else None,
+            'collector_number': collector_number,
+            'quantity': int(quantity) if quantity != None else 1
+        })
+    return lines
+
+# Resolves every line of a decklist at once. Names match the whole card name or
+# the name of the front face (ex. Delver of Secrets for Delver of Secrets // Insectile Aberration),
+# both of which are indexed (see migrations.py). Each line returns one row per printing
+# (and finish) the user owns, or a single row of NULLs if they don't own any.
+# Found is false if no card has that name (and set/collector number) at all
+DECKLIST_QUERY = '''
+                 WITH Lines(LineNumber, Name, SetCode, CollectorNumber) AS (
+                     SELECT * FROM unnest(%(line_numbers)s::INTEGER[], %(names)s::VARCHAR[], %(set_codes)s::VARCHAR[], %(collector_numbers)s::VARCHAR[])
+                 ), NameMatches AS (
+                     SELECT Lines.LineNumber, Lines.SetCode, Lines.CollectorNumber, Cards.ID, Cards.SetID, Cards.CollectorNumber AS CardCollectorNumber, Cards.LangID FROM Lines
+                     INNER JOIN Cards ON LOWER(Cards.Name) = LOWER(Lines.Name)
+                     UNION
+                     SELECT Lines.LineNumber, Lines.SetCode, Lines.CollectorNumber, Cards.ID, Cards.SetID, Cards.CollectorNumber, Cards.LangID FROM Lines
+                     INNER JOIN Cards ON LOWER(split_part(Cards.Name, ' // ', 1)) = LOWER(Lines.Name)
+                 ), Matches AS (
+                     SELECT NameMatches.LineNumber, NameMatches.ID, Sets.Code, NameMatches.CardCollectorNumber, NameMatches.LangID FROM NameMatches
+                     INNER JOIN Sets ON Sets.ID = NameMatches.SetID
+                     WHERE (NameMatches.SetCode IS NULL OR Sets.Code = NameMatches.SetCode) AND
+                           (NameMatches.CollectorNumber IS NULL OR NameMatches.CardCollectorNumber = NameMatches.CollectorNumber)
+                 ), Owned AS (
+                     SELECT Matches.LineNumber, Matches.ID, Matches.Code, Matches.CardCollectorNumber, Finishes.Finish, Langs.Lang, SUM(Colls.Quantity) AS Quantity FROM Matches
+                     INNER JOIN FinishCards ON FinishCards.CardID = Matches.ID
+                     INNER JOIN Collections AS Colls ON Colls.FinishCardID = FinishCards.ID AND Colls.UserID = %(user_id)s
+                     INNER JOIN Finishes ON Finishes.ID = FinishCards.FinishID
+                     INNER JOIN Langs ON Langs.ID = Matches.LangID
+                     GROUP BY Matches.LineNumber, Matches.ID, Matches.Code, Matches.CardCollectorNumber, Finishes.Finish, Langs.Lang
+                 )
+                 SELECT Lines.LineNumber,
+                        EXISTS (SELECT 1 FROM Matches WHERE Matches.LineNumber = Lines.LineNumber),
+                        Owned.ID, Owned.Code, Owned.CardCollectorNumber, Owned.Finish, Owned.Lang, Owned.Quantity
+                 FROM Lines
+                 LEFT JOIN Owned ON Owned.LineNumber = Lines.LineNumber
+                 ORDER BY Lines.LineNumber, Owned.Quantity DESC
+                 '''
+
+@app.route("/api/collection/decklist", methods = ['POST'])
+def api_collection_decklist():
+    """For each line of a decklist, how many copies of that card are in a collection and which printings they are"""
+    con = get_database_connection()
+    cur = con.cursor()
+
+    authed_user_id, error = get_user_id(cur)
+    if error:
+        return json.dumps(error)
+
+    content_type = request.headers.get('Content-Type')
+    if (content_type != 'application/json'):
+        error = {'successful': False, 'error': f"Expected Content-Type: application/json, found {content_type}"}
+        return json.dumps(error)
+
+    request_json = request.json
+    if request_json == None or request_json == "":
+        error = {'successful': False, 'error': f"Expected content, got empty POST body"}
+        return json.dumps(error)
+
+    username = request_json.get('username')
+    if username == None:
+        error = {'successful': False, 'error': "Didn't find expected key \"username\""}
+        return json.dumps(error)
+
+    decklist = request_json.get('decklist')
+    if type(decklist) != str:
+        error = {'successful': False, 'error': f"Expected key \"decklist\" to be of type str, got {str(type(decklist).__name__)}"}
+        return json.dumps(error)
+
+    try:
+        user_id = get_user_id_by_username(username, cur)
+    except NotFoundException as e:
+        return json.dumps({'successful': False, 'error': str(e)})
+
+    if authed_user_id != user_id:
+        error = {'successful': False, 'error': "You are not authorized to access this collection."}
+        return json.dumps(error)
+
+    lines = parse_decklist(decklist)
+    if len(lines) > DECKLIST_MAX_LINES:
+        error = {'successful': False, 'error': f"Decklist is too long, at most {DECKLIST_MAX_LINES} lines are allowed"}
+        return json.dumps(error)
+
+    res = cur.execute(DECKLIST_QUERY, {
+        'user_id': user_id,
+        'line_numbers': list(range(len(lines))),
+        'names': [line['name'] for line in lines],
+        'set_codes': [line['set'] for line in lines],
+        'collector_numbers': [line['collector_number'] for line in lines]
+    })
+
+    for line in lines:
+        line['found'] = False
+        line['owned'] = 0
+        line['printings'] = []
+
+    for line_number, found, scryfall_id, set_code, collector_number, finish, lang, quantity in res.fetchall():
+        line = lines[line_number]
+        line['found'] = found
+        if scryfall_id == None:
+            continue
+
+        line['owned'] += quantity
+        line['printings'].append({
+            'scryfall_id': str(scryfall_id),
+            'set': set_code,
+            'collector_number': collector_number,
+            'finish': finish,
+            'language': lang,
+            'quantity': quantity
+        })
+
+    for line in lines:
+        line['missing'] = max(line['quantity'] - line['owned'], 0)
+
+    return_obj = {'successful': True, 'lines': lines}
+    return json.dumps(return_obj)
+
+EXPORT_COLUMNS = ['name', 'set', 'collector_number', 'finish', 'language', 'condition', 'signed', 'altered', 'notes', 'quantity', 'scryfall_id']
+
+# Rows are pulled from a server side cursor this many at a time
+EXPORT_FETCH_SIZE = 2000
+
+@app.route("/api/collection/export", methods = ['GET'])
+def api_collection_export():
+    con = get_database_connection()
+    cur = con.cursor()
+
+    args = request.args
+    username = args.get('username')
+    export_format = args.get('format', 'csv')
+
+    authed_user_id, error = get_user_id(cur)
+    if error:
+        return json.dumps(error)
+
+    if username == None:
+        error = {'successful': False, 'error': "Didn't find expected query parameter \"username\""}
+        return json.dumps(error)
+
+    if export_format not in ['csv', 'jsonl']:
+        error = {'successful': False, 'error': f'Unsupported value for query parameter "format". Expected "csv" or "jsonl". Got {export_format}'}
+        return json.dumps(error)
+
+    try:
+        user_id = get_user_id_by_username(username, cur)
+    except NotFoundException as e:
+        return json.dumps({'successful': False, 'error': str(e)})
+
+    if authed_user_id != user_id:
+        error = {'successful': False, 'error': "You are not authorized to access this collection."}
+        return json.dumps(error)
+
+    def generate_rows():
+        # A named (server side) cursor means only EXPORT_FETCH_SIZE rows are
+        # ever in memory no matter how big the collection is
+        with con.cursor(name='collection_export') as export_cur:
+            export_cur.itersize = EXPORT_FETCH_SIZE
+            export_cur.execute('''SELECT Cards.Name, Sets.Code, Cards.CollectorNumber, Finishes.Finish, Langs.Lang, Colls.Condition, Colls.Signed, Colls.Altered, Colls.Notes, Colls.Quantity, Cards.ID FROM Collections Colls
+                               INNER JOIN FinishCards ON Colls.FinishCardID = FinishCards.ID
+                               INNER JOIN Cards ON FinishCards.CardID = Cards.ID
+                               INNER JOIN Finishes ON FinishCards.FinishID = Finishes.ID
+                               INNER JOIN Langs ON Cards.LangID = Langs.ID
+                               INNER JOIN Sets ON Cards.SetID = Sets.ID
+                               WHERE Colls.UserID = %s
+                               ORDER BY Cards.Name, Cards.ReleasedAt DESC, Colls.ID
+                               ''', (user_id,))
+            for row in export_cur:
+                yield row[:-1] + (str(row[-1]),)
+
+    def generate_csv():
+        line = io.StringIO()
+        writer = csv.writer(line)
+
+        writer.writerow(EXPORT_COLUMNS)
+        for row in generate_rows():
+            writer.writerow(row)
+            yield line.getvalue()
+            line.seek(0)
+            line.truncate()
+
+        # Header only collections still need the header
+        yield line.getvalue()
+
+    def generate_jsonl():
+        for row in generate_rows():
+            yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+
+    if export_format == 'csv':
+        generator = generate_csv()
+        mimetype = 'text/csv'
+    else:
+        generator = generate_jsonl()
+        mimetype = 'application/x-ndjson'
+
+    # stream_with_context keeps the request (and its database connection)
+    # around until the last row is sent
+    response = app.response_class(stream_with_context(generator), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="collection.{export_format}"'
+    return response
 
 @app.route("/signup", methods=["GET", "POST"])
 def signup():
     if request.method == "GET":
-        with open('./html/signup.html', 'r') as signup_html:
-            return render_template_string(signup_html.read())
+        return render_template('signup.html')
     elif request.method == "POST":
-        con = get_database_connection()
-        cur = con.cursor()
-
         username = request.form.get('username')
         password = request.form.get('password')
         print(username, password)
@@ -901,7 +1990,16 @@ def signup():
             flash("Must enter a password")
             return redirect(request.url)
 
-        password_hash = ph.hash(password)
+        # Hashing can wait in password_hashing_pool's queue, so it's done before we
+        # take a connection (load_user may have taken one already) to leave them for other requests
+        release_database_connection()
+        try:
+            password_hash = password_hashing_pool.hash(password)
+        except HashingPoolFullException:
+            return password_hashing_busy('signup.html')
+
+        con = get_database_connection()
+        cur = con.cursor()
         try:
             res = cur.execute('''INSERT INTO Users(Username, PasswordHash)
                               VALUES(%s, %s)
@@ -917,6 +2015,7 @@ def signup():
         user = User(user_id, username)
         user.is_authenticated = True
         login_user(user)
+        remember_user(user)
         return redirect(f'{username}/collection')
     else:
         return f"Unhandled REST method {request.method}"
@@ -924,25 +2023,21 @@ def signup():
 @app.route("/<username>/collection")
 @login_required
 def collection(username):
-    with open('./html/collection.html', 'r') as collection_html:
-        return render_template_string(collection_html.read(), username=username)
+    return render_template('collection.html', username=username)
 
 @app.route("/<username>/collection/add")
 @login_required
 def collection_add(username):
-    with open('./html/collection_add.html', 'r') as collection_add_html:
-        return render_template_string(collection_add_html.read(), username=username)
+    return render_template('collection_add.html', username=username)
 
 @app.route("/generate_token", methods=["GET", "POST"])
 @login_required
 def generate_token():
     if request.method == "GET":
-        with open('./html/generate_token.html', 'r') as generate_token_html:
-            return render_template_string(generate_token_html.read())
+        return render_template('generate_token.html')
     elif request.method == "POST":
         con = get_database_connection()
         cur = con.cursor()
-        hasher = hashlib.new(HASH_FUNCTION)
 
         content_type = request.headers.get('Content-Type')
         if (content_type != 'application/json'):
@@ -961,8 +2056,7 @@ def generate_token():
 
         token_bytes = secrets.token_bytes(64)
         token_hex = token_bytes.hex()
-        hasher.update(token_bytes)
-        hashed_token_bytes = hasher.digest()
+        hashed_token_bytes = hash_token(token_bytes)
 
         cur.execute('''INSERT INTO APITokens(UserID, TokenHash, ValidUntil)
                     VALUES(%s, %s, %s)
@@ -973,35 +2067,61 @@ def generate_token():
     else:
         return f"Unhandled REST method {request.method}"
 
+@app.route("/api/token", methods=["DELETE"])
+def api_token():
+    con = get_database_connection()
+    cur = con.cursor()
+
+    content_type = request.headers.get('Content-Type')
+    if (content_type != 'application/json'):
+        error = {'successful': False, 'error': f"Expected Content-Type: application/json, found {content_type}"}
+        return json.dumps(error)
+
+    request_json = request.json
+    if request_json == None:
+        error = {'successful': False, 'error': "Expected json body, but didn't find one"}
+        return json.dumps(error)
+
+    user_id, error = get_user_id(cur)
+    if error:
+        return json.dumps(error)
+
+    token = request_json.get('token')
+    if type(token) != str:
+        error = {'successful': False, 'error': "Expected key \"token\" to be the token to revoke"}
+        return json.dumps(error)
+
+    try:
+        hashed_token_bytes = hash_token(binascii.unhexlify(token))
+    except (binascii.Error, ValueError):
+        error = {'successful': False, 'error': "Token is invalid"}
+        return json.dumps(error)
+
+    res = cur.execute('''DELETE FROM APITokens
+                      WHERE TokenHash = %s AND UserID = %s
+                      RETURNING ID
+                      ''', (hashed_token_bytes, user_id))
+    if res.fetchone() == None:
+        error = {'successful': False, 'error': "Token is invalid"}
+        return json.dumps(error)
+
+    con.commit()
+    # Takes effect in this worker right away, other workers
+    # stop accepting it within TOKEN_CACHE_TTL seconds
+    token_cache.invalidate(hashed_token_bytes)
+
+    return json.dumps({'successful': True})
+
 @app.route("/deckbuilder")
 @login_required
 def deckbuilder():
-    return render_template_string('''
-<style>
-  .column {
-    position: relative;
-    top: 0;
-    left: 0px;
-  }
-  .card-image {
-    width: 150px;
-    height: auto;
-    position: absolute;
-    border-radius: 10px;
-  }
-</style>
-<script>
-</script>
-<div class=column>
-{% for i in range(10000) %}
-<img class="card-image" src=https://c1.scryfall.com/file/scryfall-cards/normal/front/b/4/b4ea262c-ea32-4aca-b96b-58f556a8dffc.jpg loading="lazy" style="top: {{ 20 * i }}px"></img>
-{% endfor %}
-</div>''')
+    return render_template('deckbuilder.html')
 
 @app.route("/logout")
 @login_required
 def logout():
     logout_user()
+    session.pop('user', None)
     next = request.args.get('next')
     if not is_safe_url(next):
         return abort(400)
@@ -1011,8 +2131,7 @@ def logout():
 @app.route("/login", methods=['GET', 'POST'])
 def login():
     if request.method == 'GET':
-        with open('./html/login.html', 'r') as login:
-            return render_template_string(login.read())
+        return render_template('login.html')
 
     elif request.method == 'POST':
         con = get_database_connection()
@@ -1040,22 +2159,37 @@ def login():
 
 
         id, password_hash = row
+        # Checking the password can wait in password_hashing_pool's queue,
+        # the connection goes back to the pool for other requests in the meantime
+        release_database_connection()
         try:
-            ph.verify(password_hash, password)
+            password_hashing_pool.verify(password_hash, password)
         except VerifyMismatchError:
             flash("Incorrect password")
             return redirect(request.url)
-
-        if ph.check_needs_rehash(password_hash):
-            cur.execute('''UPDATE Users
-                        SET PasswordHash = %s
-                        WHERE ID = %s
-                        ''', (ph.hash(password), id))
-            con.commit()
+        except HashingPoolFullException:
+            return password_hashing_busy('login.html')
+
+        if password_hashing_pool.check_needs_rehash(password_hash):
+            # The password was right so this is only an upgrade, it can wait for a quieter login
+            try:
+                new_password_hash = password_hashing_pool.hash(password)
+            except HashingPoolFullException:
+                new_password_hash = None
+
+            if new_password_hash != None:
+                con = get_database_connection()
+                cur = con.cursor()
+                cur.execute('''UPDATE Users
+                            SET PasswordHash = %s
+                            WHERE ID = %s
+                            ''', (new_password_hash, id))
+                con.commit()
 
         user = User(id, username)
         user.is_authenticated = True
         login_user(user)
+        remember_user(user)
 
         next = request.args.get('next')
         if not is_safe_url(next):
@@ -0,0 +1,168 @@
+from contextvars import ContextVar
+import bisect, threading, time
+import psycopg
+
+# Request latencies in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Request and response bodies in bytes
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+def escape_label_value(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(label_names: tuple, label_values: tuple, extra: str = '') -> str:
+    labels = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    if extra != '':
+        labels.append(extra)
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(labels) + '}'
+
+class Counter:
+    def __init__(self, name: str, description: str, label_names: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values: tuple, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = list(self._values.items())
+
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for label_values, value in values:
+            lines.append(f'{self.name}{format_labels(self.label_names, label_values)} {value}')
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, description: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # Maps label values -> [count in each bucket (and one for +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values: tuple, value: float):
+        # The first bucket value fits in, buckets are cumulative but that's only worked out in render
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry == None:
+                entry = [[0] * (len(self.buckets) + 1), 0]
+                self._values[label_values] = entry
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bucket}"'
+                lines.append(f'{self.name}_bucket{format_labels(self.label_names, label_values, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.label_names, label_values)} {total}')
+            lines.append(f'{self.name}_count{format_labels(self.label_names, label_values)} {cumulative}')
+        return lines
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, description: str, label_names: tuple) -> Counter:
+        counter = Counter(name, description, label_names)
+        self.metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, description: str, label_names: tuple, buckets: tuple) -> Histogram:
+        histogram = Histogram(name, description, label_names, buckets)
+        self.metrics.append(histogram)
+        return histogram
+
+    def render(self) -> str:
+        """Everything in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        return '\n'.join(lines) + '\n'
+
+# Every process keeps its own numbers, so each worker has to be scraped on its own
+registry = Registry()
+
+request_duration = registry.histogram('http_request_duration_seconds', 'Time spent handling requests', ('endpoint', 'method'), LATENCY_BUCKETS)
+requests_total = registry.counter('http_requests_total', 'Requests handled', ('endpoint', 'method', 'status'))
+request_size = registry.histogram('http_request_size_bytes', 'Size of request bodies', ('endpoint',), SIZE_BUCKETS)
+response_size = registry.histogram('http_response_size_bytes', 'Size of response bodies (after compression), streamed responses are left out', ('endpoint',), SIZE_BUCKETS)
+db_queries_total = registry.counter('db_queries_total', 'Database queries run', ('endpoint',))
+db_query_seconds_total = registry.counter('db_query_seconds_total', 'Time spent waiting on database queries', ('endpoint',))
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+# The QueryStats for the current request (threads and asyncio tasks each have their own)
+current_query_stats = ContextVar('current_query_stats', default=None)
+
+def track_queries() -> QueryStats:
+    """Starts counting the queries run from here on (in this thread or task)"""
+    stats = QueryStats()
+    current_query_stats.set(stats)
+    return stats
+
+def record_query(seconds: float):
+    stats = current_query_stats.get()
+    if stats != None:
+        stats.count += 1
+        stats.seconds += seconds
+
+# Use these as the cursor_factory of a connection to count its queries
+class MetricsCursor(psycopg.Cursor):
+    def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - start)
+
+class AsyncMetricsCursor(psycopg.AsyncCursor):
+    async def execute(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(*args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    async def executemany(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().executemany(*args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - start)
+
+def record_request(endpoint: str, method: str, status: int, seconds: float, request_bytes: int | None, response_bytes: int | None, query_stats: QueryStats | None):
+    request_duration.observe((endpoint, method), seconds)
+    requests_total.inc((endpoint, method, str(status)))
+    request_size.observe((endpoint,), request_bytes or 0)
+    if response_bytes != None:
+        response_size.observe((endpoint,), response_bytes)
+    if query_stats != None:
+        db_queries_total.inc((endpoint,), query_stats.count)
+        db_query_seconds_total.inc((endpoint,), query_stats.seconds)
@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+"""
+Versioned schema migrations for the app and the card catalog.
+Run them once before starting (or restarting) the app:
+    python migrations.py
+main.py only checks that the database is new enough when it starts and
+convert_scryfall_to_sql.py runs them before it imports the catalog
+"""
+import psycopg
+from argon2 import PasswordHasher
+
+# Every migration is run in order in the same transaction it's recorded in.
+# Never change a migration once it's been run somewhere, add a new one instead.
+#
+# The first two are written to work on databases that were set up before
+# migrations existed, they skip anything that's already there
+
+def create_catalog_tables(cur: psycopg.Cursor):
+    cur.execute('''CREATE TABLE IF NOT EXISTS Langs
+                (
+                ID   INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Lang VARCHAR             NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Layouts
+                (
+                ID     INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Layout VARCHAR                 NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS ImageStatuses
+                (
+                ID          INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                ImageStatus VARCHAR                 NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Legalities
+                (
+                ID       INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Legality VARCHAR                 NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS SetTypes
+                (
+                ID   INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Type VARCHAR             NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Sets
+                (
+                ID            UUID    PRIMARY KEY             NOT NULL,
+                Name          VARCHAR                         NOT NULL UNIQUE,
+                TypeID        INTEGER REFERENCES SetTypes(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                Code          VARCHAR                         NOT NULL UNIQUE,
+                MtgoCode      VARCHAR                                        ,
+                TcgplayerID   VARCHAR                                        ,
+                ReleasedAt    DATE                                           ,
+                BlockCode     VARCHAR                                        ,
+                Block         VARCHAR                                        ,
+                ParentSetCode VARCHAR                                        ,
+                CardCount     VARCHAR                         NOT NULL       ,
+                PrintedSize   VARCHAR                                        ,
+                Digital       VARCHAR                         NOT NULL       ,
+                FoilOnly      VARCHAR                         NOT NULL       ,
+                NonfoilOnly   VARCHAR                         NOT NULL       ,
+                IconSVGURI    VARCHAR                         NOT NULL
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Rarities
+                (
+                ID     INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Rarity VARCHAR                 NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS BorderColors
+                (
+                ID          INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                BorderColor VARCHAR             NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Frames
+                (
+                ID    INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Frame VARCHAR                 NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Colors
+                (
+                ID    INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Color CHAR(1) NOT NULL UNIQUE
+                )
+                ''')
+
+
+    # foil and nonfoil are deprecated so we don't care about them
+    #
+    # we don't collect the artist_ids because I don't have a good way
+    # to check what artist_id is for what artist
+    #
+    # oracle_id, type_line, cmc (maybe others) are supposed to not be nullable
+    # but sometimes they are :shrug:
+    #
+    # DefaultLang and PrintingID are the only columns that are calculated.
+    # PrintingID is the same for every language of a printing (same set and collector number)
+    cur.execute('''CREATE TABLE IF NOT EXISTS Cards
+                   (
+                   ID                      UUID        PRIMARY KEY                               NOT NULL,
+                   OracleID                UUID                                                          ,
+                   MtgoID                  INTEGER                                                       ,
+                   MtgoFoilID              INTEGER                                                       ,
+                   TcgplayerID             INTEGER                                                       ,
+                   CardmarketID            INTEGER                                                       ,
+                   Name                    VARCHAR                                               NOT NULL,
+                   LangID                  INTEGER                 REFERENCES Langs(id) DEFERRABLE INITIALLY DEFERRED          NOT NULL,
+                   DefaultLang             BOOLEAN                                               NOT NULL,
+                   ReleasedAt              DATE                                                  NOT NULL,
+                   LayoutID                INTEGER                 REFERENCES Layouts(id) DEFERRABLE INITIALLY DEFERRED        NOT NULL,
+                   HighresImage            BOOLEAN                                               NOT NULL,
+                   ImageStatusID           INTEGER                 REFERENCES ImageStatuses(id) DEFERRABLE INITIALLY DEFERRED  NOT NULL,
+                   NormalImageURI          VARCHAR                                                       ,
+                   ManaCost                VARCHAR                                                       ,
+                   Cmc                     REAL                                                          ,
+                   TypeLine                VARCHAR                                                       ,
+                   OracleText              VARCHAR                                                       ,
+                   Power                   VARCHAR                                                       ,
+                   Toughness               VARCHAR                                                       ,
+                   LegalStandardID         INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalFutureID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalHistoricID         INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalGladiatorID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalPioneerID          INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalExplorerID         INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalModernID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalLegacyID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalPauperID           INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalVintageID          INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalPennyID            INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalCommanderID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalBrawlID            INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalHistoricBrawlID    INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalAlchemyID          INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalPauperCommanderID  INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalDuelID             INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalOldschoolID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   LegalPremodernID        INTEGER                 REFERENCES Legalities(id) DEFERRABLE INITIALLY DEFERRED     NOT NULL,
+                   Reserved                BOOLEAN                                               NOT NULL,
+                   Oversized               BOOLEAN                                               NOT NULL,
+                   Promo                   BOOLEAN                                               NOT NULL,
+                   Reprint                 BOOLEAN                                               NOT NULL,
+                   Variation               BOOLEAN                                               NOT NULL,
+                   SetID                   UUID                    REFERENCES Sets(id) DEFERRABLE INITIALLY DEFERRED           NOT NULL,
+                   CollectorNumber         VARCHAR                                               NOT NULL,
+                   Digital                 BOOLEAN                                               NOT NULL,
+                   RarityID                INTEGER                 REFERENCES Rarities(id) DEFERRABLE INITIALLY DEFERRED       NOT NULL,
+                   FlavorText              VARCHAR                                                       ,
+                   Artist                  VARCHAR                                                       ,
+                   IllustrationID          UUID                                                          ,
+                   BorderColorID           INTEGER                 REFERENCES BorderColors(id) DEFERRABLE INITIALLY DEFERRED   NOT NULL,
+                   FrameID                 INTEGER                 REFERENCES Frames(id) DEFERRABLE INITIALLY DEFERRED         NOT NULL,
+                   FullArt                 BOOLEAN                                               NOT NULL,
+                   Textless                BOOLEAN                                               NOT NULL,
+                   Booster                 BOOLEAN                                               NOT NULL,
+                   StorySpotlight          BOOLEAN                                               NOT NULL,
+                   PrintingID              INTEGER                                               NOT NULL,
+                   UNIQUE(SetID, CollectorNumber, LangID)
+                   )
+                 ''')
+
+
+
+    # Why UNIQUE(CardID, Name, NormalImageURI)
+    # CardID + Name isn't sufficent because of SLD Stitch in Time (and others)
+    # CardID + NormalImageURI isn't sufficent because NormalImageURI is NULL
+    # when both "faces" are on the same side of the card (ex. aftermath cards)
+    # TODO: Needs colors junction
+    cur.execute('''CREATE TABLE IF NOT EXISTS Faces
+                (
+                ID             INTEGER PRIMARY KEY          GENERATED ALWAYS AS IDENTITY,
+                CardID         UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED      NOT NULL,
+                Name           VARCHAR                           NOT NULL,
+                ManaCost       VARCHAR                           NOT NULL,
+                TypeLine       VARCHAR                                   ,
+                OracleText     VARCHAR                           NOT NULL,
+                FlavorText     VARCHAR                                   ,
+                Artist         VARCHAR                                   ,
+                ArtistID       UUID                                      ,
+                IllustrationID UUID                                      ,
+                NormalImageURI VARCHAR
+                )
+                ''')
+
+
+    # We _could_ make a table for the MultiverseIDs and
+    # have this be forign keys to each table, but that seems
+    # unnecessary
+    cur.execute('''CREATE TABLE IF NOT EXISTS MultiverseIDCards
+                (
+                ID           INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                CardID       UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                MultiverseID INTEGER                      NOT NULL
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS ColorCards
+                (
+                ID      INTEGER  PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                CardID  UUID     REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                ColorID INTEGER  REFERENCES Colors(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                UNIQUE(CardID, ColorID)
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS ColorIdentityCards
+                (
+                ID      INTEGER  PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                CardID  UUID     REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                ColorID INTEGER  REFERENCES Colors(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                UNIQUE(CardID, ColorID)
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Keywords
+                (
+                ID      INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Keyword VARCHAR NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS KeywordCards
+                (
+                ID        INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                CardID    UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                KeywordID INTEGER REFERENCES Keywords(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                UNIQUE(CardID, KeywordID)
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Games
+                (
+                ID   INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Game VARCHAR NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS GameCards
+                (
+                ID     INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                CardID UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                GameID INTEGER REFERENCES Games(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                UNIQUE(CardID, GameID)
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Finishes
+                (
+                ID     INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Finish VARCHAR NOT NULL UNIQUE
+                )
+                ''')
+
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS FinishCards
+                (
+                ID       INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                CardID   UUID    REFERENCES Cards(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                FinishID INTEGER REFERENCES Finishes(id) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                UNIQUE(CardID, FinishID)
+                )
+                ''')
+
+
+    # Used by the name search indexes (see create_catalog_indexes)
+    cur.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # Version is bumped at the end of every import so main.py knows
+    # to throw away anything it cached from the old catalog
+    cur.execute('''CREATE TABLE IF NOT EXISTS CatalogVersion
+                (
+                ID         INTEGER     PRIMARY KEY CHECK (ID = 1),
+                Version    INTEGER     NOT NULL,
+                ImportedAt TIMESTAMPTZ NOT NULL
+                )
+                ''')
+
+    # Databases from before PrintingID existed need the column added
+    # and filled in for the cards that are already there
+    cur.execute('ALTER TABLE Cards ADD COLUMN IF NOT EXISTS PrintingID INTEGER')
+    cur.execute('''UPDATE Cards SET PrintingID = Printings.PrintingID
+                FROM (SELECT ID, DENSE_RANK() OVER (ORDER BY SetID, CollectorNumber) AS PrintingID FROM Cards) Printings
+                WHERE Cards.ID = Printings.ID AND Cards.PrintingID IS NULL
+                ''')
+    cur.execute('ALTER TABLE Cards ALTER COLUMN PrintingID SET NOT NULL')
+
+def create_collection_tables(cur: psycopg.Cursor):
+    cur.execute('''CREATE TABLE IF NOT EXISTS Users
+                (
+                ID           INTEGER PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                Username     VARCHAR NOT NULL,
+                PasswordHash VARCHAR NOT NULL,
+                UNIQUE(Username)
+                )
+                ''')
+
+    # Why aren't we salting these hashes?
+    # https://security.stackexchange.com/questions/209936/do-i-need-to-use-salt-with-api-key-hashing
+    cur.execute('''CREATE TABLE IF NOT EXISTS APITokens
+                (
+                ID         INTEGER     PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                UserID     INTEGER     REFERENCES Users(ID) NOT NULL,
+                TokenHash  BYTEA       UNIQUE NOT NULL,
+                ValidUntil TIMESTAMPTZ
+                )
+                ''')
+
+    # Postgres has no CREATE TYPE IF NOT EXISTS
+    cur.execute("""DO $$ BEGIN
+                    CREATE TYPE condition AS ENUM
+                    ('Damaged', 'Heavily Played', 'Moderately Played', 'Lightly Played', 'Near Mint');
+                EXCEPTION WHEN duplicate_object THEN NULL;
+                END $$""")
+
+    cur.execute('''CREATE TABLE IF NOT EXISTS Collections
+                (
+                ID           INTEGER   PRIMARY KEY GENERATED ALWAYS AS IDENTITY,
+                UserID       INTEGER   REFERENCES Users(ID)       DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                FinishCardID INTEGER   REFERENCES FinishCards(ID) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                Condition    condition NOT NULL,
+                Signed       BOOLEAN   NOT NULL,
+                Altered      BOOLEAN   NOT NULL,
+                Notes        VARCHAR   NOT NULL,
+                Quantity     INTEGER   NOT NULL,
+                UNIQUE(UserID, FinishCardID, Condition, Signed, Altered, Notes)
+                )
+                ''')
+
+def add_default_user(cur: psycopg.Cursor):
+    # Log in as me with the password foo
+    ph = PasswordHasher()
+    password_hash = ph.hash('foo')
+
+    cur.execute('''INSERT INTO Users(Username, PasswordHash) VALUES(%s, %s) ON CONFLICT DO NOTHING''', ('me', password_hash))
+
+def create_collection_stats(cur: psycopg.Cursor):
+    # See collection_stats.py
+    cur.execute('''CREATE TABLE CollectionStats
+                (
+                UserID    INTEGER REFERENCES Users(ID) NOT NULL,
+                Dimension VARCHAR NOT NULL,
+                Value     VARCHAR NOT NULL,
+                Quantity  INTEGER NOT NULL,
+                PRIMARY KEY(UserID, Dimension, Value)
+                )
+                ''')
+
+    # Fills in the stats for the collections that already exist. This is a copy of
+    # collection_stats.REBUILD_STATS_QUERY as it was when this migration was
+    # written, so later changes to that module don't change what this does
+    cur.execute('''
+                WITH Changes(UserID, FinishCardID, Delta) AS (
+                    SELECT UserID, FinishCardID, Quantity FROM Collections
+                ), ChangedCards AS (
+                    SELECT Changes.UserID, Changes.Delta, Cards.ID, Cards.SetID, Cards.RarityID, Cards.TypeLine FROM Changes
+                    INNER JOIN FinishCards ON FinishCards.ID = Changes.FinishCardID
+                    INNER JOIN Cards ON Cards.ID = FinishCards.CardID
+                ), Dimensions(UserID, Dimension, Value, Delta) AS (
+                    SELECT UserID, 'total', '', Delta FROM ChangedCards
+                    UNION ALL
+                    SELECT UserID, 'sets', Sets.Code, Delta FROM ChangedCards
+                    INNER JOIN Sets ON Sets.ID = ChangedCards.SetID
+                    UNION ALL
+                    SELECT UserID, 'rarities', Rarities.Rarity, Delta FROM ChangedCards
+                    INNER JOIN Rarities ON Rarities.ID = ChangedCards.RarityID
+                    UNION ALL
+                    SELECT UserID, 'colors', COALESCE(Colors.Color, 'C'), Delta FROM ChangedCards
+                    LEFT JOIN ColorCards ON ColorCards.CardID = ChangedCards.ID
+                    LEFT JOIN Colors ON Colors.ID = ColorCards.ColorID
+                    UNION ALL
+                    SELECT UserID, 'types', Types.Type, Delta FROM ChangedCards
+                    CROSS JOIN LATERAL (SELECT DISTINCT unnest(string_to_array(split_part(ChangedCards.TypeLine, ' — ', 1), ' ')) AS Type) Types
+                    WHERE Types.Type = ANY(%s)
+                )
+                INSERT INTO CollectionStats(UserID, Dimension, Value, Quantity)
+                SELECT UserID, Dimension, Value, SUM(Delta) FROM Dimensions
+                GROUP BY UserID, Dimension, Value
+                ''', (['Artifact', 'Battle', 'Creature', 'Enchantment', 'Instant', 'Kindred', 'Land', 'Planeswalker', 'Sorcery', 'Tribal'],))
+
+def create_prices(cur: psycopg.Cursor):
+    # Filled in by convert_scryfall_to_sql.py, only FinishCards with at least one price have a row.
+    # Each row has the prices for its finish (ex. usd_foil for foil) in cents (hundredths of a tix),
+    # SetID is copied from Cards so valuing a collection by set doesn't need to touch Cards
+    cur.execute('''CREATE TABLE Prices
+                (
+                FinishCardID INTEGER PRIMARY KEY REFERENCES FinishCards(ID) DEFERRABLE INITIALLY DEFERRED,
+                SetID        UUID    REFERENCES Sets(ID) DEFERRABLE INITIALLY DEFERRED NOT NULL,
+                USD          INTEGER,
+                EUR          INTEGER,
+                Tix          INTEGER
+                )
+                ''')
+
+def create_catalog_indexes(cur: psycopg.Cursor):
+    # These stay in place through imports, convert_scryfall_to_sql.py replaces
+    # the cards with DELETE and COPY so the app can keep reading the old ones
+    # (and using these indexes) until it commits.
+    # Imports from before this migration built them themselves, hence IF NOT EXISTS
+
+    # Trigram indexes let LOWER(Name) LIKE '%text%' (the card search in main.py)
+    # use an index instead of scanning every card.
+    # The partial one is for searches that only look at DefaultLang cards
+    cur.execute('''CREATE INDEX IF NOT EXISTS CardsLowerNameTrgmIndex
+                ON Cards USING GIN (LOWER(Name) gin_trgm_ops)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS CardsDefaultLowerNameTrgmIndex
+                ON Cards USING GIN (LOWER(Name) gin_trgm_ops)
+                WHERE DefaultLang = true''')
+
+    # These match the ORDER BY Name, ReleasedAt DESC, ID that the card listings
+    # in main.py use, so a page (especially a cursor based one) is a short index scan
+    cur.execute('''CREATE INDEX IF NOT EXISTS CardsSortIndex
+                ON Cards (Name, ReleasedAt DESC, ID)''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS CardsDefaultSortIndex
+                ON Cards (Name, ReleasedAt DESC, ID)
+                WHERE DefaultLang = true''')
+
+    # Finds every language of a printing with one probe (see /api/all_cards/languages)
+    cur.execute('''CREATE INDEX IF NOT EXISTS CardsPrintingIndex
+                ON Cards (PrintingID, LangID)''')
+
+    # Exact name lookups for the decklist check in main.py, by the
+    # whole name and by the front face's name (ex. Fire for Fire // Ice)
+    cur.execute('''CREATE INDEX IF NOT EXISTS CardsLowerNameIndex
+                ON Cards (LOWER(Name))''')
+    cur.execute('''CREATE INDEX IF NOT EXISTS CardsLowerFrontNameIndex
+                ON Cards (LOWER(split_part(Name, ' // ', 1)))''')
+
+def count_all_face_types(cur: psycopg.Cursor):
+    # The types in CollectionStats used to only count a card's front face, this
+    # recounts them with the types of every face. Like create_collection_stats it
+    # has its own copy of the query so later changes to collection_stats.py don't change it
+    cur.execute('''DELETE FROM CollectionStats WHERE Dimension = 'types' ''')
+    cur.execute('''
+                INSERT INTO CollectionStats(UserID, Dimension, Value, Quantity)
+                SELECT Collections.UserID, 'types', Types.Type, SUM(Collections.Quantity) FROM Collections
+                INNER JOIN FinishCards ON FinishCards.ID = Collections.FinishCardID
+                INNER JOIN Cards ON Cards.ID = FinishCards.CardID
+                CROSS JOIN LATERAL (SELECT DISTINCT unnest(string_to_array(split_part(Face.TypeLine, ' — ', 1), ' ')) AS Type
+                                    FROM unnest(string_to_array(Cards.TypeLine, ' // ')) AS Face(TypeLine)) Types
+                WHERE Types.Type = ANY(%s)
+                GROUP BY Collections.UserID, Types.Type
+                ''', (['Artifact', 'Battle', 'Creature', 'Enchantment', 'Instant', 'Kindred', 'Land', 'Planeswalker', 'Sorcery', 'Tribal'],))
+
+MIGRATIONS = [
+    create_catalog_tables,
+    create_collection_tables,
+    add_default_user,
+    create_collection_stats,
+    create_prices,
+    create_catalog_indexes,
+    count_all_face_types
+]
+
+# The version a database is at after running every migration
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Any number works, it just has to be the same for everyone running migrations
+MIGRATION_LOCK_ID = 7235
+
+class SchemaVersionException(Exception):
+    pass
+
+def get_schema_version(cur: psycopg.Cursor) -> int:
+    """The number of migrations that have been run on the database"""
+    res = cur.execute('''SELECT to_regclass('SchemaVersion')''')
+    if res.fetchone()[0] == None:
+        return 0
+
+    res = cur.execute('''SELECT Version FROM SchemaVersion''')
+    row = res.fetchone()
+    if row == None:
+        return 0
+    return row[0]
+
+def check_schema_version(cur: psycopg.Cursor):
+    """
+    Raises SchemaVersionException if the database is missing migrations.
+    Databases that are ahead are fine so older code keeps running while a new version rolls out
+    """
+    version = get_schema_version(cur)
+    if version < SCHEMA_VERSION:
+        raise SchemaVersionException(f"The database schema is at version {version} but version {SCHEMA_VERSION} is needed, run migrations.py")
+
+def migrate(con: psycopg.Connection) -> int:
+    """Runs any migrations the database is missing and returns how many were run"""
+    with con.transaction():
+        cur = con.cursor()
+
+        # Makes anyone else running migrations wait until we're done
+        cur.execute('''SELECT pg_advisory_xact_lock(%s)''', (MIGRATION_LOCK_ID,))
+
+        cur.execute('''CREATE TABLE IF NOT EXISTS SchemaVersion
+                    (
+                    ID         INTEGER     PRIMARY KEY CHECK (ID = 1),
+                    Version    INTEGER     NOT NULL,
+                    MigratedAt TIMESTAMPTZ NOT NULL
+                    )
+                    ''')
+
+        start_version = get_schema_version(cur)
+        version = start_version
+        for migration in MIGRATIONS[start_version:]:
+            version += 1
+            print(f"Running migration {version} ({migration.__name__})")
+            migration(cur)
+
+            cur.execute('''INSERT INTO SchemaVersion (ID, Version, MigratedAt)
+                        VALUES (1, %s, now())
+                        ON CONFLICT (ID) DO UPDATE
+                        SET Version = EXCLUDED.Version, MigratedAt = EXCLUDED.MigratedAt''', (version,))
+
+        return version - start_version
+
+if __name__ == '__main__':
+    import config
+
+    con = psycopg.connect(user = config.DB_USER, password = config.DB_PASSWORD, host = config.DB_HOST, port = config.DB_PORT)
+    migrations_run = migrate(con)
+    print(f"Ran {migrations_run} migrations, the database is at version {SCHEMA_VERSION}")
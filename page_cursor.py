@@ -0,0 +1,62 @@
+from datetime import date
+import json, base64, uuid
+
+class InvalidCursorException(Exception):
+    pass
+
+# Cursors are opaque to clients, they're just the sort key of the
+# last row on the page packed up in base64
+def encode_page_cursor(name: str, released_at: date, id_: str | int) -> str:
+    cursor_json = json.dumps([name, released_at.isoformat(), id_])
+    return base64.urlsafe_b64encode(cursor_json.encode()).decode()
+
+def decode_page_cursor(cursor: str, id_type: type) -> tuple[str, date, int | uuid.UUID]:
+    """
+    Unpacks a cursor made by encode_page_cursor. id_type is the type of the ID
+    the rows are sorted by (int or uuid.UUID). Clients can send us anything,
+    so every field is checked here instead of failing once it reaches postgres
+    """
+    error = InvalidCursorException(f"Invalid value for query parameter \"after\": \"{cursor}\"")
+    try:
+        name, released_at, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise error
+
+    # Postgres strings can't hold NUL
+    if type(name) != str or '\x00' in name or type(released_at) != str:
+        raise error
+
+    try:
+        released_at = date.fromisoformat(released_at)
+    except ValueError:
+        raise error
+
+    if id_type == int:
+        # bool is a subclass of int, but not a valid ID
+        if type(id_) != int:
+            raise error
+    else:
+        if type(id_) != str:
+            raise error
+        try:
+            id_ = uuid.UUID(id_)
+        except ValueError:
+            raise error
+
+    return name, released_at, id_
+
+def keyset_condition(name_column: str, released_at_column: str, id_column: str) -> str:
+    """
+    SQL condition matching the rows that come after a cursor when ordering by
+    name_column, released_at_column DESC, id_column.
+    Takes the parameters (name, name, released_at, released_at, id).
+    The leading name_column >= lets postgres start an index scan at the cursor
+    """
+    return f'''{name_column} >= %s AND
+               ({name_column} > %s OR
+                {released_at_column} < %s OR
+                ({released_at_column} = %s AND {id_column} > %s))'''
+
+def keyset_params(cursor: str, id_type: type) -> tuple:
+    name, released_at, id_ = decode_page_cursor(cursor, id_type)
+    return (name, name, released_at, released_at, id_)
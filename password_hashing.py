@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor
+from argon2 import PasswordHasher
+import threading
+
+class HashingPoolFullException(Exception):
+    pass
+
+class PasswordHashingPool:
+    """
+    Runs Argon2 on its own small pool of threads so a burst of logins can only
+    tie up `workers` CPUs. At most max_queued calls wait for a free thread,
+    anything past that raises HashingPoolFullException straight away
+    instead of making the request wait
+    """
+    def __init__(self, hasher: PasswordHasher, workers: int, max_queued: int):
+        self.hasher = hasher
+        self.rejected = 0
+
+        # argon2 releases the GIL while it hashes so these really do run in parallel
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='argon2')
+        # One slot per running or waiting call
+        self._slots = threading.BoundedSemaphore(workers + max_queued)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise HashingPoolFullException("Too many passwords are being checked right now")
+
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        # Exceptions (like VerifyMismatchError) are raised here
+        return future.result()
+
+    def hash(self, password: str) -> str:
+        return self._run(self.hasher.hash, password)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """Same as PasswordHasher.verify, raises VerifyMismatchError if the password is wrong"""
+        return self._run(self.hasher.verify, password_hash, password)
+
+    def check_needs_rehash(self, password_hash: str) -> bool:
+        # Only parses the hash, so there's no need to send it to the pool
+        return self.hasher.check_needs_rehash(password_hash)
@@ -6,8 +6,8 @@ function set_modal_card(scryfall_id) {
         .then(response => response.json())
         .then(scryfall_card => {
             console.log(scryfall_card);
-            if (scryfall_card.image_uris) {
-                modal_card.src = scryfall_card.image_uris[0];
+            if (scryfall_card.cached_image_uris) {
+                modal_card.src = scryfall_card.cached_image_uris[0];
             }
             else {
                 console.log("Couldn't find image_uris for card:");
@@ -0,0 +1,70 @@
+function printing_text(printing) {
+    return `${printing.quantity}x ${printing.set.toUpperCase()} ${printing.collector_number} (${printing.language}, ${printing.finish})`;
+}
+
+function show_results(lines) {
+    var tbody = document.querySelector("#decklist-results tbody");
+    var summary = document.getElementById("decklist-summary");
+
+    while (tbody.lastChild) {
+        tbody.removeChild(tbody.lastChild);
+    }
+
+    var total_missing = 0;
+    for (var line of lines) {
+        total_missing += line.missing;
+
+        var row = document.createElement("tr");
+        if (!line.found) {
+            row.className = "not-found";
+        }
+        else if (line.missing > 0) {
+            row.className = "missing";
+        }
+
+        var cells = [
+            line.found ? line.line : `${line.line} (no card with that name)`,
+            line.quantity,
+            line.owned,
+            line.missing,
+            line.printings.map(printing_text).join(", ")
+        ];
+        for (var cell_text of cells) {
+            var cell = document.createElement("td");
+            cell.textContent = cell_text;
+            row.appendChild(cell);
+        }
+        tbody.appendChild(row);
+    }
+
+    summary.textContent = `Missing ${total_missing} cards`;
+}
+
+function main() {
+    const username = document.querySelector("main").dataset.username;
+    const check_button = document.getElementById("check-button");
+    const decklist = document.getElementById("decklist");
+    const summary = document.getElementById("decklist-summary");
+
+    check_button.addEventListener('click', () => {
+        fetch('/api/collection/decklist', {
+            method: 'POST',
+            headers: {
+                    'Content-Type':'application/json'
+            },
+            body: JSON.stringify({
+                "username": username,
+                "decklist": decklist.value
+            })
+        })
+            .then(response => response.json())
+            .then(json_response => {
+                if (!json_response.successful) {
+                    summary.textContent = json_response.error;
+                    return;
+                }
+                show_results(json_response.lines);
+            });
+    });
+}
+document.addEventListener("DOMContentLoaded", main);
@@ -37,17 +37,22 @@ async function add_page(cards_data, create_card) {
     })
         .then(response => response.json())
         .then(cards_response => {
-            // TODO: Check the "not_found" member of cards_response
-            // to ensure we got everything
-            // TODO: Test what happens if you get only one result
-            // the "object" member, might help there
+            // Cards that couldn't be found are listed in "not_found"
+            // instead of "data", so match them up by id
+            var scryfall_cards = {};
+            for (var scryfall_card of cards_response.data) {
+                scryfall_cards[scryfall_card.scryfall_id] = scryfall_card;
+            }
+            for (var scryfall_id of cards_response.not_found) {
+                console.log(`Couldn't find card with id ${scryfall_id}`);
+            }
 
-            for (var i = 0; i < cards_data.length; i++) {
-                var collection_card = cards_data[i];
-                var scryfall_card = cards_response.data[i];
+            cards_data = cards_data.filter(card => card.scryfall_id in scryfall_cards);
+            for (var collection_card of cards_data) {
+                var scryfall_card = scryfall_cards[collection_card.scryfall_id];
 
-                if (scryfall_card.image_uris){
-                    collection_card.image_src = scryfall_card.image_uris[0];
+                if (scryfall_card.thumbnail_uris){
+                    collection_card.image_src = scryfall_card.thumbnail_uris[0];
                 }
                 else {
                     // TODO: Load default replacement image
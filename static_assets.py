@@ -0,0 +1,117 @@
+import os, re, hashlib, mimetypes
+from compression import available_encodings, compress
+
+# Matches the relative imports in our JS modules (ex. from './paged_cards.js')
+JS_IMPORT_PATTERN = re.compile(r'''(\bfrom\s+['"])(\./[^'"]+)(['"])''')
+
+class StaticAsset:
+    def __init__(self, path: str, content: bytes):
+        self.path = path
+        self.digest = hashlib.sha256(content).hexdigest()[:16]
+
+        root, ext = os.path.splitext(path)
+        self.fingerprinted_path = f'{root}.{self.digest}{ext}'
+
+        self.mimetype = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+        # Maps Content-Encoding -> body, identity is the uncompressed file
+        # These are only compressed once so we use the highest levels
+        self.encodings = {'identity': content}
+        for encoding, level in [('gzip', 9), ('br', 11)]:
+            if encoding in available_encodings():
+                compressed = compress(content, encoding, level)
+                if len(compressed) < len(content):
+                    self.encodings[encoding] = compressed
+
+    def etag(self, encoding: str) -> str:
+        # Each encoding is a different set of bytes so they need their own ETag
+        if encoding == 'identity':
+            return self.digest
+        return f'{self.digest}-{encoding}'
+
+class StaticAssets:
+    """
+    Loads everything in static_folder into memory along with a content hash
+    (used in fingerprinted URLs) and precompressed copies of each file
+    """
+    def __init__(self, static_folder: str):
+        self.static_folder = static_folder
+        self._manifest = ({}, {})
+        self.load()
+
+    def load(self):
+        """(Re)loads every file, safe to call while other threads are using the assets"""
+        # Scanned before reading so an edit made while we load is picked up next time
+        files = self._scan()
+
+        assets = {}
+        for path in files:
+            self._load_asset(path, assets, [])
+
+        fingerprinted_assets = {asset.fingerprinted_path: asset for asset in assets.values()}
+        # Swapped in as one object so readers never see half of a reload
+        self._manifest = (assets, fingerprinted_assets)
+        self._files = files
+
+    def reload_changed(self):
+        """Reloads the assets if a file was added, removed or modified since they were loaded"""
+        if self._scan() != self._files:
+            self.load()
+
+    def _scan(self) -> dict:
+        """Maps the path of every file to its (modification time, size)"""
+        files = {}
+        for directory, _, filenames in os.walk(self.static_folder):
+            for filename in filenames:
+                full_path = os.path.join(directory, filename)
+                stat = os.stat(full_path)
+                files[os.path.relpath(full_path, self.static_folder).replace(os.sep, '/')] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def _load_asset(self, path: str, assets: dict, loading: list) -> StaticAsset | None:
+        if path in assets:
+            return assets[path]
+
+        full_path = os.path.join(self.static_folder, path)
+        # Import cycles (or imports of files that don't exist) are left as they are
+        if path in loading or not os.path.isfile(full_path):
+            return None
+
+        with open(full_path, 'rb') as f:
+            content = f.read()
+
+        # JS modules import each other by URL, so the imports have to point at
+        # the fingerprinted files too. Otherwise a changed import would be
+        # served from the browser's cache forever
+        if path.endswith('.js'):
+            def fingerprint_import(match):
+                imported_path = os.path.normpath(os.path.join(os.path.dirname(path), match.group(2))).replace(os.sep, '/')
+                imported = self._load_asset(imported_path, assets, loading + [path])
+                if imported == None:
+                    return match.group(0)
+                return f'{match.group(1)}./{os.path.relpath(imported.fingerprinted_path, os.path.dirname(path))}{match.group(3)}'
+
+            content = JS_IMPORT_PATTERN.sub(fingerprint_import, content.decode()).encode()
+
+        # Compressing is the slow part, so files that didn't change keep their old asset
+        asset = self._manifest[0].get(path)
+        if asset == None or asset.encodings['identity'] != content:
+            asset = StaticAsset(path, content)
+        assets[path] = asset
+        return asset
+
+    def url_path(self, path: str) -> str:
+        """The fingerprinted path for path (relative to the static folder)"""
+        assets, _ = self._manifest
+        asset = assets.get(path)
+        if asset == None:
+            return path
+        return asset.fingerprinted_path
+
+    def find(self, path: str) -> tuple[StaticAsset | None, bool]:
+        """Returns the asset at path and if path was fingerprinted"""
+        assets, fingerprinted_assets = self._manifest
+        asset = fingerprinted_assets.get(path)
+        if asset != None:
+            return asset, True
+        return assets.get(path), False
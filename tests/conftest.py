@@ -0,0 +1,23 @@
+import os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# main.py connects to the database in config.py as soon as it's imported,
+# so anything that needs it only runs where one has been set up (and migrated)
+try:
+    import config
+except ImportError:
+    config = None
+
+@pytest.fixture(scope='session')
+def main():
+    if config == None:
+        pytest.skip('needs a config.py pointing at a migrated database')
+
+    import main
+    return main
+
+@pytest.fixture
+def client(main):
+    return main.app.test_client()
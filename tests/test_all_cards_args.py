@@ -0,0 +1,28 @@
+import pytest
+
+def test_defaults(main):
+    assert main.parse_all_cards_args({}) == (('', 0, False, None), None)
+
+def test_search(main):
+    args = {'query': 'search', 'text': 'Bolt', 'page': '2', 'default': 'true', 'after': ''}
+
+    assert main.parse_all_cards_args(args) == (('Bolt', 2, True, ''), None)
+
+@pytest.mark.parametrize('args', [
+    {'page': 'abc'},
+    {'page': '-1'},
+    {'page': '1.5'},
+    {'query': 'nonsense'},
+    {'query': 'search'}
+])
+def test_bad_args_are_errors(main, args):
+    params, error = main.parse_all_cards_args(args)
+
+    assert params == None
+    assert error['successful'] == False
+
+def test_bad_page_is_not_a_server_error(client):
+    response = client.get('/api/all_cards?page=abc')
+
+    assert response.status_code == 200
+    assert b'"successful": false' in response.data
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+import json
+import time
+import pytest
+
+CARD_ID = 'catalog-caching-test-card'
+CARD = {'scryfall_id': CARD_ID, 'name': 'Test Card'}
+IMPORTED_AT = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+@pytest.fixture
+def catalog(main, monkeypatch):
+    """Pretends the catalog is at version 7, without asking the database"""
+    monkeypatch.setattr(main, 'catalog_version', (7, IMPORTED_AT))
+    monkeypatch.setattr(main, 'catalog_version_checked_at', time.monotonic())
+    monkeypatch.setattr(main, 'CATALOG_VERSION_CHECK_INTERVAL', 3600)
+    main.card_cache.put(CARD_ID, CARD)
+    yield
+    main.card_cache.clear()
+
+@pytest.fixture
+def no_database(main, monkeypatch):
+    """Makes any attempt to use the database fail the test"""
+    def getconn(*args, **kwargs):
+        raise AssertionError("The database was used")
+    monkeypatch.setattr(main.pool, 'getconn', getconn)
+
+def test_by_id_sends_cache_headers(client, catalog):
+    response = client.get(f'/api/by_id?scryfall_id={CARD_ID}')
+
+    assert response.status_code == 200
+    assert json.loads(response.data) == CARD
+    assert response.headers['ETag'] == 'W/"catalog-7"'
+    assert response.last_modified == IMPORTED_AT
+    assert response.cache_control.public
+    assert response.cache_control.max_age != None
+
+def test_if_none_match_is_answered_without_the_database(client, catalog, no_database):
+    response = client.get(f'/api/by_id?scryfall_id={CARD_ID}', headers={'If-None-Match': 'W/"catalog-7"'})
+
+    assert response.status_code == 304
+    assert response.headers['ETag'] == 'W/"catalog-7"'
+    assert response.data == b''
+
+def test_languages_if_none_match_is_answered_without_the_database(client, catalog, no_database):
+    response = client.get(f'/api/all_cards/languages?scryfall_id={CARD_ID}', headers={'If-None-Match': 'W/"catalog-7"'})
+
+    assert response.status_code == 304
+
+def test_if_modified_since_is_answered_without_the_database(client, catalog, no_database):
+    response = client.get(f'/api/by_id?scryfall_id={CARD_ID}', headers={'If-Modified-Since': 'Wed, 01 May 2024 12:00:00 GMT'})
+
+    assert response.status_code == 304
+
+def test_old_etag_gets_the_new_catalog(client, catalog):
+    response = client.get(f'/api/by_id?scryfall_id={CARD_ID}', headers={'If-None-Match': 'W/"catalog-6"'})
+
+    assert response.status_code == 200
+    assert response.headers['ETag'] == 'W/"catalog-7"'
+
+def test_new_version_clears_catalog_caches(main, catalog):
+    main.set_catalog_version((8, IMPORTED_AT.replace(day=2)))
+
+    assert main.card_cache.get(CARD_ID) == None
+    assert main.catalog_version == (8, IMPORTED_AT.replace(day=2))
+
+def test_older_import_does_not_replace_newer(main, catalog):
+    main.set_catalog_version((6, IMPORTED_AT.replace(day=1, month=4)))
+
+    assert main.catalog_version == (7, IMPORTED_AT)
+    assert main.card_cache.get(CARD_ID) == CARD
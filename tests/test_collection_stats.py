@@ -0,0 +1,60 @@
+import uuid
+import pytest
+
+@pytest.fixture
+def transaction(main):
+    """A cursor in a transaction that's rolled back afterwards and a new user's ID"""
+    with main.pool.connection() as con:
+        cur = con.cursor()
+        res = cur.execute('''INSERT INTO Users(Username, PasswordHash) VALUES(%s, '') RETURNING ID''', (f'stats-{uuid.uuid4()}',))
+        user_id = res.fetchone()[0]
+
+        yield cur, user_id
+        con.rollback()
+
+def add_cards(cur, user_id: int, finish_card_ids: list[int], quantity: int):
+    import collection_stats
+
+    for finish_card_id in finish_card_ids:
+        cur.execute('''INSERT INTO Collections(UserID, FinishCardID, Condition, Signed, Altered, Notes, Quantity)
+                       VALUES(%s, %s, 'Near Mint', FALSE, FALSE, '', %s)''', (user_id, finish_card_id, quantity))
+    collection_stats.update_collection_stats(cur, user_id, [(finish_card_id, quantity) for finish_card_id in finish_card_ids])
+
+def test_rebuild_matches_updates(transaction):
+    import collection_stats
+    cur, user_id = transaction
+
+    res = cur.execute('''SELECT ID FROM FinishCards ORDER BY ID LIMIT 20''')
+    finish_card_ids = [row[0] for row in res.fetchall()]
+    if len(finish_card_ids) == 0:
+        pytest.skip('needs cards in the database')
+
+    add_cards(cur, user_id, finish_card_ids, 2)
+    # Taking cards out goes through the same query with a negative delta
+    cur.execute('''UPDATE Collections SET Quantity = Quantity - 1 WHERE UserID = %s AND FinishCardID = %s''', (user_id, finish_card_ids[0]))
+    collection_stats.update_collection_stats(cur, user_id, [(finish_card_ids[0], -1)])
+
+    updated = collection_stats.get_collection_stats(cur, user_id)
+    assert updated['total'] == 2 * len(finish_card_ids) - 1
+
+    collection_stats.rebuild_collection_stats(cur)
+    assert collection_stats.get_collection_stats(cur, user_id) == updated
+
+def test_every_face_types_count(transaction):
+    import collection_stats
+    cur, user_id = transaction
+
+    res = cur.execute('''SELECT FinishCards.ID, Cards.TypeLine FROM FinishCards
+                         INNER JOIN Cards ON Cards.ID = FinishCards.CardID
+                         WHERE Cards.TypeLine LIKE '% // %' LIMIT 1''')
+    row = res.fetchone()
+    if row == None:
+        pytest.skip('needs a card with several faces in the database')
+    finish_card_id, type_line = row
+
+    add_cards(cur, user_id, [finish_card_id], 1)
+
+    types = set()
+    for face in type_line.split(' // '):
+        types.update(word for word in face.split(' — ')[0].split(' ') if word in collection_stats.CARD_TYPES)
+    assert collection_stats.get_collection_stats(cur, user_id)['types'] == {card_type: 1 for card_type in types}
@@ -0,0 +1,91 @@
+import hashlib, os
+import pytest
+from image_cache import ImageCache, DirectoryFetcher, ImageFetchException, Image
+
+IMAGE_URL = 'https://cards.scryfall.io/normal/front/0/0/0000579f.jpg?1562894979'
+
+class CountingFetcher(DirectoryFetcher):
+    def __init__(self, directory: str):
+        super().__init__(directory)
+        self.fetches = 0
+
+    def fetch(self, url: str) -> bytes:
+        self.fetches += 1
+        return super().fetch(url)
+
+def write_source_image(source_dir, content: bytes):
+    path = source_dir / 'normal' / 'front' / '0' / '0' / '0000579f.jpg'
+    path.parent.mkdir(parents=True)
+    path.write_bytes(content)
+
+@pytest.fixture
+def source_dir(tmp_path):
+    directory = tmp_path / 'source'
+    directory.mkdir()
+    return directory
+
+@pytest.fixture
+def fetcher(source_dir):
+    return CountingFetcher(str(source_dir))
+
+@pytest.fixture
+def cache(tmp_path, fetcher):
+    return ImageCache(str(tmp_path / 'cache'), fetcher, thumbnail_width=50)
+
+def test_images_are_stored_by_content(cache, source_dir):
+    content = b'not really a jpeg'
+    write_source_image(source_dir, content)
+
+    image = cache.get(IMAGE_URL)
+
+    digest = hashlib.sha256(content).hexdigest()
+    assert image.digest == digest
+    assert image.path == os.path.join(cache.cache_dir, 'objects', digest[:2], f'{digest}.jpg')
+    assert image.mimetype == 'image/jpeg'
+    with open(image.path, 'rb') as f:
+        assert f.read() == content
+
+def test_second_read_is_a_cache_hit(cache, fetcher, source_dir):
+    write_source_image(source_dir, b'not really a jpeg')
+
+    first = cache.get(IMAGE_URL)
+    second = cache.get(IMAGE_URL)
+
+    assert fetcher.fetches == 1
+    assert second.path == first.path
+    assert second.digest == first.digest
+
+def test_identical_images_are_stored_once(cache, source_dir):
+    write_source_image(source_dir, b'not really a jpeg')
+
+    first = cache.get(IMAGE_URL)
+    second = cache.get(IMAGE_URL.replace('?1562894979', '?1700000000'))
+
+    assert second.path == first.path
+
+def test_missing_image_raises(cache):
+    with pytest.raises(ImageFetchException):
+        cache.get(IMAGE_URL)
+
+def test_paths_stay_inside_the_source_directory(tmp_path, source_dir):
+    (tmp_path / 'secret.jpg').write_bytes(b'secret')
+
+    with pytest.raises(ImageFetchException):
+        DirectoryFetcher(str(source_dir)).fetch('https://cards.scryfall.io/../secret.jpg')
+
+@pytest.mark.skipif(Image == None, reason='needs Pillow')
+def test_thumbnail(cache, source_dir):
+    import io
+    original = io.BytesIO()
+    Image.new('RGB', (200, 280), 'red').save(original, 'JPEG')
+    write_source_image(source_dir, original.getvalue())
+
+    thumbnail = cache.get_thumbnail(IMAGE_URL)
+
+    full_image = cache.get(IMAGE_URL)
+    assert thumbnail.digest == f'{full_image.digest}-50'
+    assert thumbnail.mimetype == 'image/jpeg'
+    with Image.open(thumbnail.path) as image:
+        assert image.size == (50, 70)
+    # Made once, served from disk after that
+    assert cache.get_thumbnail(IMAGE_URL).path == thumbnail.path
@@ -0,0 +1,53 @@
+from datetime import date
+import base64, json, uuid
+import pytest
+from page_cursor import InvalidCursorException, encode_page_cursor, decode_page_cursor, keyset_params
+
+CARD_ID = '0000579f-7b35-4ed3-b44c-db2a538066fe'
+
+def pack(value) -> str:
+    """A cursor holding any json, like a client tampering with one would send"""
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+def test_round_trip_card_cursor():
+    cursor = encode_page_cursor('Fury Sliver', date(2006, 10, 6), CARD_ID)
+
+    assert decode_page_cursor(cursor, uuid.UUID) == ('Fury Sliver', date(2006, 10, 6), uuid.UUID(CARD_ID))
+
+def test_round_trip_collection_cursor():
+    cursor = encode_page_cursor('Fury Sliver', date(2006, 10, 6), 42)
+
+    assert keyset_params(cursor, int) == ('Fury Sliver', 'Fury Sliver', date(2006, 10, 6), date(2006, 10, 6), 42)
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    'aGVsbG8',
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+    pack('abc'),
+    pack({'name': 1, 'released_at': 2, 'id': 3}),
+    pack(['Fury Sliver', '2006-10-06']),
+    pack(['Fury Sliver', '2006-10-06', 42, 'extra'])
+])
+def test_garbage_cursors_are_rejected(cursor):
+    with pytest.raises(InvalidCursorException):
+        decode_page_cursor(cursor, int)
+
+@pytest.mark.parametrize('value', [
+    [1, '2006-10-06', 42],
+    ['Fury\x00Sliver', '2006-10-06', 42],
+    ['Fury Sliver', 20061006, 42],
+    ['Fury Sliver', 'yesterday', 42],
+    ['Fury Sliver', '2006-13-45', 42],
+    ['Fury Sliver', '2006-10-06', '42'],
+    ['Fury Sliver', '2006-10-06', 4.2],
+    ['Fury Sliver', '2006-10-06', True],
+    ['Fury Sliver', '2006-10-06', None]
+])
+def test_tampered_collection_cursors_are_rejected(value):
+    with pytest.raises(InvalidCursorException):
+        decode_page_cursor(pack(value), int)
+
+@pytest.mark.parametrize('card_id', [42, 'not-a-uuid', '', None])
+def test_tampered_card_cursors_are_rejected(card_id):
+    with pytest.raises(InvalidCursorException):
+        decode_page_cursor(pack(['Fury Sliver', '2006-10-06', card_id]), uuid.UUID)
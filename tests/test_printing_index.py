@@ -0,0 +1,32 @@
+import uuid
+import pytest
+
+@pytest.fixture
+def explain(main):
+    """Returns the plan postgres picks for a query, as text"""
+    # Imported here so the test is skipped (not an error) without the app's dependencies
+    import psycopg
+
+    with main.pool.connection() as con:
+        # Client side binding, EXPLAIN can't take server side parameters
+        cur = psycopg.ClientCursor(con)
+        # A test database has too few cards for an index to beat a sequential
+        # scan, this makes postgres use any index that can answer the query
+        cur.execute('SET LOCAL enable_seqscan = off')
+
+        def explain(query: str, params: tuple) -> str:
+            res = cur.execute(f'EXPLAIN {query}', params)
+            return '\n'.join(row[0] for row in res.fetchall())
+
+        yield explain
+        con.rollback()
+
+def test_languages_query_uses_printing_index(main, explain):
+    plan = explain(main.LANGUAGES_QUERY, (uuid.uuid4(),))
+
+    assert 'cardsprintingindex' in plan.lower()
+
+def test_other_language_query_uses_printing_index(main, explain):
+    plan = explain(main.OTHER_LANGUAGE_QUERY, (1, uuid.uuid4()))
+
+    assert 'cardsprintingindex' in plan.lower()